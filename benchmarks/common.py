@@ -0,0 +1,17 @@
+"""Helpers shared by the benchmarks"""
+
+import random
+
+from hashlife.core import Node
+
+
+def reset():
+    """Empty the node store, so a run starts without another run's nodes and memos"""
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+
+
+def random_cells(size, density, seed):
+    """Return a random soup of live cells in a size x size square"""
+    rng = random.Random(seed)
+    return [(x, y) for x in range(size) for y in range(size) if rng.random() < density]
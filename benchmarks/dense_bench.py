@@ -0,0 +1,50 @@
+"""Pure hashlife against the hybrid NumPy dense engine on random soups"""
+
+import argparse
+import time
+
+from benchmarks.common import random_cells, reset
+from hashlife.core import Node, Stats, advance
+
+
+def run(cells, generations, dense_level, hit_rate):
+    reset()
+    Node.DENSE_LEVEL = dense_level
+    Node.DENSE_HIT_RATE = hit_rate
+    Node.STATS = None if hit_rate is None else Stats()
+    node = Node.from_cells(cells)
+    start = time.perf_counter()
+    advance(node, generations)
+    return time.perf_counter() - start, len(Node.ALL_NODES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=128, help="soup side in cells")
+    parser.add_argument("--density", type=float, default=0.35)
+    parser.add_argument("--generations", type=int, default=256)
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--dense-level", type=int, nargs="+", default=[4, 5, 6, 7])
+    parser.add_argument(
+        "--hit-rate", type=float, help="only step levels with a lower memo hit rate densely"
+    )
+    args = parser.parse_args()
+
+    for dense_level in [None] + args.dense_level:
+        elapsed = nodes = 0
+        for seed in range(args.seeds):
+            seconds, count = run(
+                random_cells(args.size, args.density, seed), args.generations, dense_level,
+                None if dense_level is None else args.hit_rate
+            )
+            elapsed += seconds
+            nodes += count
+        print(
+            "dense level {!s:>4}  {:8.3f}s  {:9d} nodes".format(
+                dense_level, elapsed / args.seeds, nodes // args.seeds
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Serial leap_gen against parallel_leap_gen on a random soup"""
+
+import argparse
+import concurrent.futures
+import os
+import time
+
+from benchmarks.common import random_cells, reset
+from hashlife.core import Node
+from hashlife.parallel import parallel_leap_gen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--level", type=int, default=8, help="soup side is 2 ** level")
+    parser.add_argument("--density", type=float, default=0.35)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--depth", type=int, nargs="+", default=[1, 2])
+    args = parser.parse_args()
+    cells = random_cells(2**args.level, args.density, args.seed)
+
+    reset()
+    node = Node.from_cells(cells, level=args.level).expand()
+    start = time.perf_counter()
+    node.leap_gen()
+    serial = time.perf_counter() - start
+    print("serial           {:8.3f}s".format(serial))
+    for depth in args.depth:
+        reset()
+        node = Node.from_cells(cells, level=args.level).expand()
+        # fresh workers, so no run starts with another run's worker node stores
+        with concurrent.futures.ProcessPoolExecutor(args.processes) as executor:
+            start = time.perf_counter()
+            parallel_leap_gen(node, depth, executor=executor)
+            elapsed = time.perf_counter() - start
+        print(
+            "parallel depth {} {:8.3f}s  {:.2f}x on {} processes".format(
+                depth, elapsed, serial / elapsed, args.processes
+            )
+        )
+
+if __name__ == "__main__":
+    main()
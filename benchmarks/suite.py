@@ -0,0 +1,225 @@
+"""Benchmark suite over canonical patterns, with JSON results for regression tracking
+
+Each case is advanced with advance() (step_gen, the leap_gen machinery) and with repeated
+single generations (next_gen), from an empty node store. The io cases time conversions and
+file format round trips on a random soup. Results are written as JSON and can be compared
+against a previous run, in which case the exit status is 1 if any timing regressed.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import random_cells, reset
+from hashlife import io as hlio
+from hashlife.core import Node, advance
+
+GOSPER_GUN = """\
+x = 36, y = 9, rule = B3/S23
+24bo$22bobo$12b2o6b2o12b2o$11bo3bo4b2o12b2o$2o8bo5bo3b2o$2o8bo3bob2o4bobo$10bo5bo7bo$
+11bo3bo$12b2o!
+"""
+
+# smallest known infinite growth, a block-laying switch engine, standing in for breeders
+SWITCH_ENGINE = """\
+x = 8, y = 6, rule = B3/S23
+6bo$4bob2o$4bobo$4bo$2bo$obo!
+"""
+
+GLIDER = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+
+# (name, gens for advance(), gens for next_gen)
+CASES = [
+    ("gosper_gun", 2**20, 256),
+    ("switch_engine", 2**16, 256),
+    ("random_soup", 2**10, 64),
+    ("glider_tiles", 2**16, 64),
+]
+
+# metrics where a larger value is an improvement
+HIGHER_IS_BETTER = {"gens_per_sec", "nodes_per_sec"}
+
+
+def pattern(name, seed):
+    """Return a fresh node for a benchmark case"""
+    if name == "gosper_gun":
+        return hlio.read_rle(io.StringIO(GOSPER_GUN))
+    if name == "switch_engine":
+        return hlio.read_rle(io.StringIO(SWITCH_ENGINE))
+    if name == "random_soup":
+        return Node.from_cells(random_cells(64, 0.35, seed))
+    if name == "glider_tiles":
+        # a 32 x 32 grid of identical glider cells, where almost every subtree is shared
+        return Node.from_cells((x + 8 * i, y + 8 * j) for i in range(32) for j in range(32)
+                               for x, y in GLIDER)
+    raise ValueError("unknown case {}".format(name))
+
+
+def measure(name, seed, func, generations):
+    """Run func on a fresh pattern from an empty store and return its metrics
+
+    Memory is traced in a second run, since tracemalloc slows down allocation heavy code.
+    """
+    reset()
+    node = pattern(name, seed)
+    start = time.perf_counter()
+    result = func(node)
+    seconds = time.perf_counter() - start
+    nodes = len(Node.ALL_NODES)
+    reset()
+    node = pattern(name, seed)
+    tracemalloc.start()
+    func(node)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": seconds,
+        "gens_per_sec": generations / seconds,
+        "nodes_per_sec": nodes / seconds,
+        "peak_nodes": nodes,
+        "peak_bytes": peak_bytes,
+        "population": result.population,
+    }
+
+
+def bench_case(name, leap_gens, next_gens, seed):
+    def single_steps(node):
+        for _ in range(next_gens):
+            node = advance(node, 1)
+        return node
+
+    return {
+        "leap": measure(name, seed, lambda node: advance(node, leap_gens), leap_gens),
+        "next": measure(name, seed, single_steps, next_gens),
+    }
+
+
+def timed(func, repeat):
+    """Return the best of repeat timings of func"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_io(seed, repeat):
+    reset()
+    node = Node.from_cells(random_cells(256, 0.35, seed))
+    state_map = node.as_state_map()
+    results = {
+        "from_state_map": timed(lambda: Node.from_state_map(state_map), repeat),
+        "as_state_map": timed(node.as_state_map, repeat),
+        "str_round_trip": timed(
+            lambda: hlio.str_to_state_map(hlio.state_map_to_str(state_map)), repeat
+        ),
+    }
+
+    def rle_round_trip():
+        buf = io.StringIO()
+        hlio.write_rle(node, buf)
+        buf.seek(0)
+        hlio.read_rle(buf)
+
+    def macrocell_round_trip():
+        buf = io.StringIO()
+        hlio.write_macrocell(node, buf)
+        buf.seek(0)
+        hlio.read_macrocell(buf)
+
+    results["rle_round_trip"] = timed(rle_round_trip, repeat)
+    results["macrocell_round_trip"] = timed(macrocell_round_trip, repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.snap")
+
+        def snapshot_round_trip():
+            hlio.save_snapshot(path, [node])
+            hlio.load_snapshot(path)
+
+        results["snapshot_round_trip"] = timed(snapshot_round_trip, repeat)
+    return {key: {"seconds": seconds} for key, seconds in results.items()}
+
+
+def run(cases, seed, repeat):
+    results = {}
+    for name, leap_gens, next_gens in CASES:
+        if cases and name not in cases:
+            continue
+        for mode, metrics in bench_case(name, leap_gens, next_gens, seed).items():
+            results["{}.{}".format(name, mode)] = metrics
+    if not cases or "io" in cases:
+        for name, metrics in bench_io(seed, repeat).items():
+            results["io.{}".format(name)] = metrics
+    return results
+
+
+def compare(old, new, threshold):
+    """Return a report line per shared metric and whether any got worse by over threshold"""
+    lines = []
+    regressed = False
+    for key in sorted(set(old) & set(new)):
+        for metric in sorted(set(old[key]) & set(new[key])):
+            before, after = old[key][metric], new[key][metric]
+            if metric == "population":
+                if before != after:
+                    lines.append("{} population changed {} -> {}".format(key, before, after))
+                    regressed = True
+                continue
+            if not before:
+                continue
+            change = after / before - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressed = True
+            lines.append("{:36} {:14} {:+8.1%}{}".format(key, metric, change, flag))
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "cases", nargs="*", help="subset of {} and io".format(", ".join(c[0] for c in CASES))
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many io timings")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to write")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="relative slowdown counted as a regression"
+    )
+    args = parser.parse_args()
+
+    results = run(args.cases, args.seed, args.repeat)
+    for key, metrics in sorted(results.items()):
+        print("{:36} {:8.3f}s".format(key, metrics["seconds"]))
+    with open(args.output, "w") as fileobj:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            fileobj,
+            indent=2,
+            sort_keys=True,
+        )
+    if args.compare:
+        with open(args.compare) as fileobj:
+            old = json.load(fileobj)["results"]
+        lines, regressed = compare(old, results, args.threshold)
+        print("\n".join(lines))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
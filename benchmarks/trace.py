@@ -0,0 +1,38 @@
+"""Trace leap_gen of an RLE pattern and export a flamegraph stack file and a CSV heatmap"""
+
+import argparse
+
+from hashlife.core import Node, Trace
+from hashlife.io import read_rle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pattern", help="RLE file")
+    parser.add_argument("--expand", type=int, default=2, help="levels to expand the pattern by")
+    parser.add_argument("--collapsed", default="trace.folded", help="collapsed stacks output")
+    parser.add_argument("--heatmap", default="trace.csv", help="CSV heatmap output, a row per node")
+    args = parser.parse_args()
+
+    with open(args.pattern) as fileobj:
+        node = read_rle(fileobj)
+    for _ in range(args.expand):
+        node = node.expand()
+    # build the leaf table up front so it is not charged to the first level 2 node
+    node._leaf_table()  # pylint: disable=protected-access
+    Node.TRACE = Trace()
+    node.leap_gen()
+    with open(args.collapsed, "w") as fileobj:
+        Node.TRACE.write_collapsed(fileobj)
+    with open(args.heatmap, "w") as fileobj:
+        Node.TRACE.write_heatmap(fileobj)
+    print(
+        "level {} leap of {} generations, {} nodes evaluated in {:.3f}s".format(
+            node.level, 2**(node.level - 2), sum(Node.TRACE.misses.values()),
+            sum(Node.TRACE.seconds.values())
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Cooperative asyncio wrappers around node evaluation"""
+
+import asyncio
+
+
+async def step_gen_async(node, power, chunk_size=1000, progress=None):
+    """Return node.step_gen(power), yielding to the event loop every chunk_size frames
+
+    progress, if given, is called with each Progress before yielding. Cancelling the task keeps
+    every memoized result computed so far, so a later evaluation resumes from them.
+    """
+    result = None
+    for update in node.iter_step_gen(power, chunk_size):
+        if progress is not None:
+            progress(update)
+        result = update.result
+        await asyncio.sleep(0)
+    return result
+
+
+async def next_gen_async(node, chunk_size=1000, progress=None):
+    """Return node.next_gen() without blocking the event loop"""
+    if node.level == 1:
+        raise ValueError("Cannot call next_gen() on a level 1 node")
+    return await step_gen_async(node, 0, chunk_size, progress)
+
+
+async def leap_gen_async(node, chunk_size=1000, progress=None):
+    """Return node.leap_gen() without blocking the event loop"""
+    if node.level == 1:
+        raise ValueError("Cannot call leap_gen() on a level 1 node")
+    return await step_gen_async(node, node.level - 2, chunk_size, progress)
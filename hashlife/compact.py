@@ -0,0 +1,433 @@
+"""Compact node store keeping nodes as integer ids in flat array columns
+
+Node objects cost a couple of hundred bytes each, most of it object and dict overhead.
+CompactStore keeps every canonical node as an integer id instead: its level, children,
+population and memoized next_gen and leap_gen results live in array columns indexed by id,
+and canonicalization uses an open-addressing table of ids hashed on the four child ids. That
+is some 40 bytes per node.
+
+CompactNode handles give the Node API on top. Handles are made on demand and compare equal
+by store and id, so compare them with == rather than is. Evaluation runs the same explicit
+stack as Node's over ids, at about the same speed. The store only grows, it has no collect().
+flatten() uses Node's table format, so Node.unflatten() and CompactStore.adopt() convert
+between the two.
+"""
+
+import array
+
+from hashlife.core import MultiStateNode, State, StateMap, Universe
+
+# ids 0 and 1 are the dead and alive cells, and level 1 nodes get ids 2 to 17 in the order of
+# their cells packed as nw, ne, sw, se from the lowest bit up, like Node's _bits
+_LEVEL1 = 2
+_CELL_STATES = (State.DEAD, State.ALIVE)
+
+
+class CompactStore:
+    """Canonical nodes of a two-state rule as integer ids in array columns"""
+
+    def __init__(self, rule="B3/S23"):
+        node_cls = Universe(rule).node_cls
+        if issubclass(node_cls, MultiStateNode):
+            raise ValueError("CompactStore only supports two-state rules")
+        self.rule = node_cls.rule_string()
+        # 4x4 -> 2x2 base case, indexed and valued in packed cells like Node._leaf_table()
+        # pylint: disable=protected-access
+        self._leaf_table = array.array("H", node_cls._leaf_table())
+        self._level = bytearray((0, 0))
+        self._nw = array.array("I", (0, 0))
+        self._ne = array.array("I", (0, 0))
+        self._sw = array.array("I", (0, 0))
+        self._se = array.array("I", (0, 0))
+        self._population = array.array("Q", (0, 1))
+        # 0 is not memoized, no result is a cell
+        self._next_gen = array.array("I", (0, 0))
+        self._leap_gen = array.array("I", (0, 0))
+        # results of other step sizes by (id, power), only filled by step_gen()
+        self._step_gen = {}
+        # open addressing with linear probing, 0 marks a free slot
+        self._table = array.array("I", bytes(4 * 64))
+        self._mask = 63
+        for bits in range(16):
+            self._join(bits & 1, bits >> 1 & 1, bits >> 2 & 1, bits >> 3 & 1)
+
+    def __len__(self):
+        """Number of nodes, cells excluded"""
+        return len(self._level) - 2
+
+    def __repr__(self):
+        return "CompactStore({!r})".format(self.rule)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns and the hash table"""
+        columns = (
+            self._nw, self._ne, self._sw, self._se, self._population, self._next_gen,
+            self._leap_gen, self._table
+        )
+        return len(self._level) + sum(len(column) * column.itemsize for column in columns)
+
+    def _join(self, nw, ne, sw, se):
+        """Return the id of the node with the given child ids, adding it if it is new"""
+        table, mask = self._table, self._mask
+        slot = _hash(nw, ne, sw, se) & mask
+        node = table[slot]
+        while node:
+            if (
+                self._nw[node] == nw and self._ne[node] == ne and self._sw[node] == sw and
+                self._se[node] == se
+            ):
+                return node
+            slot = (slot + 1) & mask
+            node = table[slot]
+        node = len(self._level)
+        if node >= 1 << 32:
+            raise OverflowError("CompactStore is full")
+        self._level.append(self._level[nw] + 1)
+        self._nw.append(nw)
+        self._ne.append(ne)
+        self._sw.append(sw)
+        self._se.append(se)
+        population = self._population
+        self._population.append(population[nw] + population[ne] + population[sw] + population[se])
+        self._next_gen.append(0)
+        self._leap_gen.append(0)
+        table[slot] = node
+        # keep the load factor at most 3/4
+        if 4 * (node - 1) > 3 * mask:
+            self._grow()
+        return node
+
+    def _grow(self):
+        mask = 2 * self._mask + 1
+        table = array.array("I", bytes(4 * (mask + 1)))
+        nw, ne, sw, se = self._nw, self._ne, self._sw, self._se
+        for node in range(_LEVEL1, len(self._level)):
+            slot = _hash(nw[node], ne[node], sw[node], se[node]) & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = node
+        self._table, self._mask = table, mask
+
+    def _handle(self, node):
+        return CompactNode(self, node)
+
+    def empty(self, level):
+        node = 0
+        for _ in range(level):
+            node = self._join(node, node, node, node)
+        return self._handle(node)
+
+    def _from_grid(self, grid):
+        while len(grid) > 1:
+            grid = [
+                list(map(self._join, north[0::2], north[1::2], south[0::2], south[1::2]))
+                for north, south in zip(grid[0::2], grid[1::2])
+            ]
+        return self._handle(grid[0][0])
+
+    def from_state_map(self, state_map):
+        """Build a node from a StateMap of State cells"""
+        return self._from_grid([[int(bool(cell)) for cell in row] for row in state_map.rows])
+
+    def from_cells(self, cells, level=None):
+        """Build a node from the (x, y) of its live cells, like Node.from_cells()"""
+        nodes = {}
+        for x, y in cells:
+            if x < 0 or y < 0:
+                raise ValueError("Cell coordinates cannot be negative")
+            nodes[(x, y)] = 1
+        fit_level = max(1, max((max(x, y) for x, y in nodes), default=0).bit_length())
+        if level is None:
+            level = fit_level
+        elif level < fit_level:
+            raise ValueError("Cells do not fit in a level {} node".format(level))
+        empty = 0
+        for _ in range(level):
+            parents = {(x >> 1, y >> 1) for x, y in nodes}
+            nodes = {
+                (x, y): self._join(
+                    nodes.get((2 * x, 2 * y), empty), nodes.get((2 * x + 1, 2 * y), empty),
+                    nodes.get((2 * x, 2 * y + 1), empty), nodes.get((2 * x + 1, 2 * y + 1), empty)
+                )
+                for x, y in parents
+            }
+            empty = self._join(empty, empty, empty, empty)
+        return self._handle(nodes.get((0, 0), empty))
+
+    def unflatten(self, table):
+        """Build the node for a table returned by flatten() or Node.flatten()"""
+        nodes = [0, 1]
+        for children in table:
+            nodes.append(self._join(*(nodes[child] for child in children)))
+        return self._handle(nodes[-1])
+
+    def adopt(self, node):
+        """Return the node of this store with the same cells as a Node or CompactNode"""
+        if isinstance(node, CompactNode) and node.store is self:
+            return node
+        if isinstance(node, MultiStateNode):
+            raise ValueError("CompactStore only supports two-state rules")
+        return self.unflatten(node.flatten())
+
+    def _centered(self, node):
+        return self._join(
+            self._se[self._nw[node]], self._sw[self._ne[node]], self._ne[self._sw[node]],
+            self._nw[self._se[node]]
+        )
+
+    def _nine_subnodes(self, node):
+        """Ids of the nine overlapping subnodes one level down, row by row from nw to se"""
+        join, nw_of, ne_of, sw_of, se_of = self._join, self._nw, self._ne, self._sw, self._se
+        nw, ne, sw, se = nw_of[node], ne_of[node], sw_of[node], se_of[node]
+        return (
+            nw,
+            join(ne_of[nw], nw_of[ne], se_of[nw], sw_of[ne]),
+            ne,
+            join(sw_of[nw], se_of[nw], nw_of[sw], ne_of[sw]),
+            join(se_of[nw], sw_of[ne], ne_of[sw], nw_of[se]),
+            join(sw_of[ne], se_of[ne], nw_of[se], ne_of[se]),
+            sw,
+            join(ne_of[sw], nw_of[se], se_of[sw], sw_of[se]),
+            se,
+        )
+
+    def _get_memo(self, node, power):
+        if power == self._level[node] - 2:
+            return self._leap_gen[node]
+        if power == 0:
+            return self._next_gen[node]
+        return self._step_gen.get((node, power), 0)
+
+    def _set_memo(self, node, power, result):
+        if power == self._level[node] - 2:
+            self._leap_gen[node] = result
+        if power == 0:
+            self._next_gen[node] = result
+        elif power != self._level[node] - 2:
+            self._step_gen[(node, power)] = result
+        return result
+
+    def _evaluate(self, root, power):
+        """Id of the centered subnode of root 2 ** power generations ahead
+
+        The same explicit stack evaluation as Node._evaluation(), on ids.
+        """
+        memo = self._get_memo(root, power)
+        if memo:
+            return memo
+        join, level_of, leaf_table = self._join, self._level, self._leaf_table
+        nw_of, ne_of, sw_of, se_of = self._nw, self._ne, self._sw, self._se
+        result = [0]
+        stack = [(root, power, 0, None, result, 0)]
+        while stack:
+            node, power, stage, parts, dest, index = stack.pop()
+            level = level_of[node]
+            leap = power == level - 2
+            if stage == 0:
+                if level == 2:
+                    bits = leaf_table[nw_of[node] - _LEVEL1 | ne_of[node] - _LEVEL1 << 4
+                                      | sw_of[node] - _LEVEL1 << 8 | se_of[node] - _LEVEL1 << 12]
+                    dest[index] = self._set_memo(node, power, bits + _LEVEL1)
+                    continue
+                if leap:
+                    parts = [0] * 9
+                    stack.append((node, power, 1, parts, dest, index))
+                    self._push_frames(stack, self._nine_subnodes(node), power - 1, parts)
+                    continue
+                parts = [self._centered(subnode) for subnode in self._nine_subnodes(node)]
+                stage = 1
+            if stage == 1:
+                n00, n01, n02, n10, n11, n12, n20, n21, n22 = parts
+                quadrants = (
+                    join(n00, n01, n10, n11),
+                    join(n01, n02, n11, n12),
+                    join(n10, n11, n20, n21),
+                    join(n11, n12, n21, n22),
+                )
+                parts = [0] * 4
+                stack.append((node, power, 2, parts, dest, index))
+                self._push_frames(stack, quadrants, power - 1 if leap else power, parts)
+                continue
+            dest[index] = self._set_memo(node, power, join(*parts))
+        return result[0]
+
+    def _push_frames(self, stack, nodes, power, parts):
+        for index in range(len(nodes) - 1, -1, -1):
+            memo = self._get_memo(nodes[index], power)
+            if memo:
+                parts[index] = memo
+            else:
+                stack.append((nodes[index], power, 0, None, parts, index))
+
+
+def _hash(nw, ne, sw, se):
+    """Slot hash of four child ids, to be masked to the table size"""
+    mixed = (nw * 0x9E3779B1 + ne * 0x85EBCA77 + sw * 0xC2B2AE3D + se * 0x27D4EB2F) & 0xFFFFFFFF
+    return mixed ^ mixed >> 16
+
+
+class CompactNode:
+    """Handle on a node of a CompactStore, with the API of Node"""
+    # pylint: disable=protected-access
+    # handles read the columns of their store directly
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, node_id):
+        self.store = store
+        self.id = node_id
+
+    def __eq__(self, other):
+        return isinstance(other, CompactNode) and other.store is self.store and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "<CompactNode {} of level {}>".format(self.id, self.level)
+
+    @property
+    def level(self):
+        return self.store._level[self.id]
+
+    @property
+    def population(self):
+        return self.store._population[self.id]
+
+    @property
+    def nw(self):
+        return self._child(self.store._nw)
+
+    @property
+    def ne(self):
+        return self._child(self.store._ne)
+
+    @property
+    def sw(self):
+        return self._child(self.store._sw)
+
+    @property
+    def se(self):
+        return self._child(self.store._se)
+
+    def _child(self, column):
+        if self.level == 0:
+            raise AttributeError("Cells have no children")
+        child = column[self.id]
+        if self.level == 1:
+            return _CELL_STATES[child]
+        return CompactNode(self.store, child)
+
+    def empty(self, level):
+        return self.store.empty(level)
+
+    def centered_subnode(self):
+        return CompactNode(self.store, self.store._centered(self.id))
+
+    def expand(self):
+        store, node = self.store, self.id
+      
+        empty = store.empty(self.level - 1).id
+        return CompactNode(
+            store,
+            store._join(
+                store._join(empty, empty, empty, store._nw[node]),
+                store._join(empty, empty, store._ne[node], empty),
+                store._join(empty, store._sw[node], empty, empty),
+                store._join(store._se[node], empty, empty, empty),
+            )
+        )
+
+    def _border_empty(self):
+        """Whether everything outside the centered subnode is empty"""
+        store, node = self.store, self.id
+      
+        nw, ne, sw, se = store._nw[node], store._ne[node], store._sw[node], store._se[node]
+        return store._population[node] == store._population[store._centered(node)]
+
+    def shrink(self):
+        if self.level < 2 or not self._border_empty():
+            raise ValueError("Cannot shrink")
+        return self.centered_subnode()
+
+    def next_gen(self):
+        if self.level < 2:
+            raise ValueError("Cannot call next_gen() on a level 1 node")
+        return CompactNode(self.store, self.store._evaluate(self.id, 0))
+
+    def leap_gen(self):
+        if self.level < 2:
+            raise ValueError("Cannot call next_gen() on a level 1 node")
+        return CompactNode(self.store, self.store._evaluate(self.id, self.level - 2))
+
+    def step_gen(self, power):
+        """Return the centered subnode 2 ** power generations ahead, see Node.step_gen()"""
+        if not 0 <= power <= self.level - 2:
+            raise ValueError("power must be between 0 and level - 2")
+        return CompactNode(self.store, self.store._evaluate(self.id, power))
+
+    def iter_live_cells(self):
+        """Yield the (x, y) of every live cell, with (0, 0) the nw corner"""
+      
+        store = self.store
+        population, level_of = store._population, store._level
+        stack = [(self.id, 0, 0)]
+        while stack:
+            node, x, y = stack.pop()
+            if not population[node]:
+                continue
+            level = level_of[node]
+            if level == 0:
+                yield x, y
+                continue
+            half = 1 << level - 1
+            stack.append((store._se[node], x + half, y + half))
+            stack.append((store._sw[node], x, y + half))
+            stack.append((store._ne[node], x + half, y))
+            stack.append((store._nw[node], x, y))
+
+    def as_state_map(self):
+        """Return the cells as a new StateMap"""
+      
+        store = self.store
+        grid = [[self.id]]
+        for _ in range(self.level):
+            expanded = []
+            for row in grid:
+                north = [None] * 2 * len(row)
+                south = [None] * 2 * len(row)
+                north[0::2] = (store._nw[node] for node in row)
+                north[1::2] = (store._ne[node] for node in row)
+                south[0::2] = (store._sw[node] for node in row)
+                south[1::2] = (store._se[node] for node in row)
+                expanded.append(north)
+                expanded.append(south)
+            grid = expanded
+        cells = [_CELL_STATES[cell] for row in grid for cell in row]
+        return StateMap.from_buffer(self.level, cells)
+
+    def flatten(self):
+        """Return the subtree in the table format of Node.flatten()"""
+      
+        store = self.store
+        columns = (store._nw, store._ne, store._sw, store._se)
+        ids = {0: 0, 1: 1}
+        table = []
+        stack = [self.id]
+        while stack:
+            node = stack[-1]
+            if node in ids:
+                stack.pop()
+                continue
+            children = tuple(column[node] for column in columns)
+            missing = [child for child in children if child not in ids]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            ids[node] = len(table) + 2
+            table.append(tuple(ids[child] for child in children))
+        return table
+
+    def __bool__(self):
+        raise RuntimeError("Cannot evaluate state of Node")
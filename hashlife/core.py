@@ -1,141 +1,704 @@
 """Core datastructures for HashLife"""
 
+import collections
+import collections.abc
 import enum
+import itertools
 import math
+import operator
+import time
+import weakref
+
+
+_FINGERPRINT_MASK = (1 << 64) - 1
+
+
+def _fingerprint(level, nw, ne, sw, se):
+    """64 bit structural hash from the fingerprints of a node's children
+
+    Only fixed constants go in, so fingerprints are stable across processes and runs.
+    """
+    fingerprint = (
+        nw * 0x9E3779B97F4A7C15 + ne * 0xC2B2AE3D27D4EB4F + sw * 0x165667B19E3779F9 +
+        se * 0xD6E8FEB86659FD93 + level
+    ) & _FINGERPRINT_MASK
+    # splitmix64 finalizer
+    fingerprint = (fingerprint ^ fingerprint >> 30) * 0xBF58476D1CE4E5B9 & _FINGERPRINT_MASK
+    fingerprint = (fingerprint ^ fingerprint >> 27) * 0x94D049BB133111EB & _FINGERPRINT_MASK
+    return fingerprint ^ fingerprint >> 31
+
+
+def _leaf_neighborhoods():
+    """Bit of each center cell of a packed 4x4 node and the mask of its eight neighbors
+
+    A 4x4 node is packed from its level 1 children's bits, nw in the lowest 4 bits up to se in
+    the highest. Centers are in nw, ne, sw, se order.
+    """
+
+    def bit(row, col):
+        return 4 * (row // 2 * 2 + col // 2) + row % 2 * 2 + col % 2
+
+    neighborhoods = []
+    for row, col in ((1, 1), (1, 2), (2, 1), (2, 2)):
+        neighbors = sum(
+            1 << bit(row + drow, col + dcol)
+            for drow in (-1, 0, 1)
+            for dcol in (-1, 0, 1)
+            if drow or dcol
+        )
+        neighborhoods.append((bit(row, col), neighbors))
+    return tuple(neighborhoods)
+
+
+_LEAF_NEIGHBORHOODS = _leaf_neighborhoods()
 
 
 class State(enum.Enum):
     ALIVE = True
     DEAD = False
 
-    def __init__(self, _):
+    def __init__(self, alive):
         self.level = 0
+        self.population = int(alive)
+        self.fingerprint = 0x2545F4914F6CDD1D if alive else 0
+        # whether the cell counts as a live neighbor
+        self._bit = int(alive)
 
     def __bool__(self):
         return self.value
 
+    # members are singletons, so identity hashing is enough and skips Enum's Python-level
+    # __hash__ for every level 1 node looked up in ALL_NODES
+    __hash__ = object.__hash__
+
+
+class Cell(int):
+    """Leaf of a multi-state rule, a small integer state where 0 is dead
+
+    Instances are canonical like nodes, so Cell(2) is Cell(2). Only state 1 counts as a live
+    neighbor, and every state but 0 counts towards population.
+    """
+    _INSTANCES = {}
+
+    def __new__(cls, state):
+        canonized = cls._INSTANCES.get(state, None)
+        if canonized is not None:
+            return canonized
+        if not 0 <= state < 256:
+            raise ValueError("Cell states must be between 0 and 255")
+        instance = super().__new__(cls, state)
+        cls._INSTANCES[state] = instance
+        instance.level = 0
+        instance.population = int(state != 0)
+        # state 1 shares State.ALIVE's fingerprint, so Life patterns match across rule kinds
+        instance.fingerprint = 0x2545F4914F6CDD1D * state & _FINGERPRINT_MASK
+        instance._bit = int(state == 1)
+        return instance
+
+    @property
+    def value(self):
+        return int(self)
+
+    def __repr__(self):
+        return "Cell({})".format(int(self))
+
+
+CELLS = tuple(Cell(state) for state in range(256))
+
 
 class StateMap:
+    """Square view of 2 ** level cells in a flat, row-major buffer of cells
+
+    Quadrants are views into the same buffer at integer offsets, so nothing is copied. A new
+    map copies rows into its own buffer once; row_slice and col_slice select a view of it.
+    """
+    __slots__ = ("level", "cells", "stride", "row", "col")
 
     def __init__(self, level, rows, row_slice=None, col_slice=None):
         self.level = level
-        self.rows = rows
-        self.row_slice = row_slice
-        self.col_slice = col_slice
+        self.cells = [cell for row in rows for cell in row]
+        self.stride = len(rows)
+        self.row = 0 if row_slice is None else row_slice.start
+        self.col = 0 if col_slice is None else col_slice.start
+
+    @classmethod
+    def from_buffer(cls, level, cells, stride=None, row=0, col=0):
+        """View of a flat list of cells without copying it, stride being the buffer's side"""
+        view = cls.__new__(cls)
+        view.level = level
+        view.cells = cells
+        view.stride = 2**level if stride is None else stride
+        view.row = row
+        view.col = col
+        return view
 
-    def _first_half(self, inslice):
-        if inslice is None:
-            return slice(0, len(self.rows) // 2)
-        return slice(inslice.start, inslice.start + (inslice.stop - inslice.start) // 2)
+    @property
+    def size(self):
+        return 2**self.level
 
-    def _second_half(self, inslice):
-        if inslice is None:
-            return slice(len(self.rows) // 2, len(self.rows))
-        return slice(inslice.start + (inslice.stop - inslice.start) // 2, inslice.stop)
+    @property
+    def row_slice(self):
+        return slice(self.row, self.row + self.size)
+
+    @property
+    def col_slice(self):
+        return slice(self.col, self.col + self.size)
+
+    @property
+    def rows(self):
+        """The view's cells as a list of row lists, a copy"""
+        start = self.row * self.stride + self.col
+        size = self.size
+        return [
+            self.cells[offset:offset + size]
+            for offset in range(start, start + size * self.stride, self.stride)
+        ]
+
+    def flat(self):
+        """The view's cells row by row, the buffer itself if the view covers all of it"""
+        if self.stride == self.size:
+            return self.cells
+        return [cell for row in self.rows for cell in row]
 
     @property
     def val(self):
-        sliced = list(map(lambda r: r[self.col_slice], self.rows[self.row_slice]))
-        if len(sliced) == 1:
-            return sliced[0][0]
-        return sliced
+        if self.level == 0:
+            return self.cells[self.row * self.stride + self.col]
+        return self.rows
+
+    def _quadrant(self, row, col):
+        return self.from_buffer(self.level - 1, self.cells, self.stride, row, col)
 
     @property
     def nw(self):
-        return self.__class__(
-            self.level - 1, self.rows, self._first_half(self.row_slice),
-            self._first_half(self.col_slice)
-        )
+        return self._quadrant(self.row, self.col)
 
     @property
     def ne(self):
-        return self.__class__(
-            self.level - 1, self.rows, self._first_half(self.row_slice),
-            self._second_half(self.col_slice)
-        )
+        return self._quadrant(self.row, self.col + self.size // 2)
 
     @property
     def sw(self):
-        return self.__class__(
-            self.level - 1, self.rows, self._second_half(self.row_slice),
-            self._first_half(self.col_slice)
-        )
+        return self._quadrant(self.row + self.size // 2, self.col)
 
     @property
     def se(self):
-        return self.__class__(
-            self.level - 1, self.rows, self._second_half(self.row_slice),
-            self._second_half(self.col_slice)
-        )
+        return self._quadrant(self.row + self.size // 2, self.col + self.size // 2)
+
+
+class Stats:
+    """Per level counters of node creation, memo use and evaluation time
+
+    Counting is enabled by assigning an instance to Node.STATS and costs one attribute check
+    per node construction and per evaluated frame while disabled. The counters are
+    collections.Counter instances keyed by node level. hook, if given, is called with this
+    Stats after every top level next_gen(), leap_gen() or step_gen().
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.reset()
+
+    def reset(self):
+        # __new__ calls that built a new node, i.e. canonicalization misses
+        self.created = collections.Counter()
+        # __new__ calls that returned an existing canonical node
+        self.canonical_hits = collections.Counter()
+        self.memo_hits = collections.Counter()
+        self.memo_misses = collections.Counter()
+        # time spent evaluating frames of each level, excluding the levels below
+        self.seconds = collections.Counter()
+
+    def memo_hit_rate(self, level):
+        lookups = self.memo_hits[level] + self.memo_misses[level]
+        return self.memo_hits[level] / lookups if lookups else None
+
+    def as_dict(self):
+        """Plain dict of all counters, for exporting"""
+        return {
+            name: dict(getattr(self, name))
+            for name in ("created", "canonical_hits", "memo_hits", "memo_misses", "seconds")
+        }
+
+
+Progress = collections.namedtuple("Progress", ("frames", "pending", "result"))
+
+
+class Trace:
+    """Per node evaluation cost of next_gen(), leap_gen() and step_gen(), for profiling
+
+    Tracing is enabled by assigning an instance to Node.TRACE and costs one attribute check per
+    evaluated frame while disabled. Each evaluated node is identified by its stack, the tuple
+    of (level, x, y) of the evaluations leading to it from the top level node. x and y are its
+    nw corner in cells east and south of the top level node's nw corner. Subresults that were
+    already memoized cost nothing and do not appear.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # time spent evaluating the node on top of each stack, excluding the nodes above it
+        self.seconds = collections.Counter()
+        # evaluations of the node on top of each stack, i.e. memo misses
+        self.misses = collections.Counter()
+
+    def write_collapsed(self, fileobj):
+        """Write self time per stack in microseconds, in the collapsed stack format
+
+        The format is the input of flamegraph.pl and is also read by speedscope and others, one
+        line of semicolon separated frames and a count per stack.
+        """
+        for stack, seconds in sorted(self.seconds.items()):
+            frames = ";".join("L{}@{},{}".format(*frame) for frame in stack)
+            fileobj.write("{} {}\n".format(frames, round(seconds * 1e6)))
+
+    def heatmap(self):
+        """Self time and misses summed per evaluated node extent
+
+        Returns a dict from (x, y, size), the nw corner and side of each node on top of a stack,
+        to [seconds, misses]. Each node's cost stays on its own extent, so a large node's self
+        time is one row and is not spread over the cells below it.
+        """
+        extents = {}
+        for stack, seconds in self.seconds.items():
+            level, x, y = stack[-1]
+            extent = extents.setdefault((x, y, 2**level), [0, 0])
+            extent[0] += seconds
+            extent[1] += self.misses[stack]
+        return extents
+
+    def write_heatmap(self, fileobj):
+        """Write heatmap() as CSV with x, y, size, seconds and misses columns"""
+        fileobj.write("x,y,size,seconds,misses\n")
+        for (x, y, size), (seconds, misses) in sorted(self.heatmap().items()):
+            fileobj.write("{},{},{},{!r},{}\n".format(x, y, size, seconds, misses))
+
+
+def _trace_stack(where, node, stage, parts, dest, index):
+    """Trace stack of an evaluation frame
+
+    where maps the id of each pending parts list to the stack of the frame that owns it and how
+    the parts are laid out: 9 for the nine overlapping subnodes, 4 for the quadrants built from
+    their results, or None for the top level result.
+    """
+    if stage:
+        return where.pop(id(parts))[0]
+    stack, layout = where[id(dest)]
+    if layout is None:
+        return ((node.level, 0, 0),)
+    level, x, y = stack[-1]
+    quarter = 2**(level - 2)
+    if layout == 9:
+        row, col = divmod(index, 3)
+    else:
+        row, col = divmod(index, 2)
+        # quadrants of the results, which are centered in the nine subnodes
+        x += quarter // 2
+        y += quarter // 2
+    return stack + ((node.level, x + col * quarter, y + row * quarter),)
+
+
+_NW = operator.attrgetter("nw")
+_NE = operator.attrgetter("ne")
+_SW = operator.attrgetter("sw")
+_SE = operator.attrgetter("se")
+
+CollectStats = collections.namedtuple(
+    "CollectStats", ("kept", "collected", "memos_dropped", "seconds")
+)
 
 
 class Node:
     # pylint: disable=no-member,access-member-before-definition
     # since we're initializing stuff in __new__, pylint can't detect members
+    # slots instead of a per-instance __dict__, nodes are the bulk of memory use
+    __slots__ = (
+        "level", "nw", "ne", "sw", "se", "population", "fingerprint", "_next_gen", "_leap_gen",
+        "_stamp", "_bits", "_step_gen"
+    )
     ALL_NODES = {}
     ALL_EMPTY = {}
     RULE_BIRTH = frozenset((3,))
     RULE_SURVIVE = frozenset((2, 3))
+    # node count above which maybe_collect() sweeps, None for unbounded
+    MAX_NODES = None
+    # memoized results not used for this many collections are evicted, None keeps all
+    MEMO_MAX_AGE = 1
+    epoch = 0
+    last_collect = None
+    # Stats instance while counting is enabled
+    STATS = None
+    # Trace instance while tracing is enabled
+    TRACE = None
+    # subtrees up to this level are stepped by hashlife.dense, which needs NumPy; None for none
+    DENSE_LEVEL = None
+    # if set, only the levels up to DENSE_LEVEL whose memo hit rate measured by STATS is below
+    # this are stepped by hashlife.dense, levels not measured yet are not
+    DENSE_HIT_RATE = None
+    # snapshot attached by hashlife.io.load_snapshot(), looked up on memo misses
+    SNAPSHOT = None
+    # 4x4 -> 2x2 base case results, rebuilt by _leaf_table() when the rules change
+    _LEAF_TABLE = None
+    _LEAF_RULES = (None, None)
+    # leaf for each state, DEAD first
+    _LEAVES = (State.DEAD, State.ALIVE)
+    # cells of a level 1 node for every 4 bit packed value
+    _LEAF_CELLS = tuple(
+        tuple(State(bool(bits >> bit & 1)) for bit in range(4)) for bits in range(16)
+    )
 
     def __new__(cls, nw, ne, sw, se):
         canonized = cls.ALL_NODES.get((nw, ne, sw, se), None)
         if canonized is not None:
+            if cls.STATS is not None:
+                cls.STATS.canonical_hits[canonized.level] += 1
             return canonized
         if not (nw.level == ne.level == sw.level == se.level):
             raise ValueError("Inconsistent subnode levels")
-        instance = super().__new__(cls)
+        # the class owning the store, which differs for universes sharing another's nodes
+        instance = object.__new__(cls._STORE_CLS)
         cls.ALL_NODES[(nw, ne, sw, se)] = instance
         instance.level = nw.level + 1
         instance.nw = nw
         instance.ne = ne
         instance.sw = sw
         instance.se = se
+        # live cell count, cached so region queries can skip or summarize whole subtrees
+        instance.population = nw.population + ne.population + sw.population + se.population
+        # equal for nodes with the same cells, in any process or universe
+        instance.fingerprint = _fingerprint(
+            instance.level, nw.fingerprint, ne.fingerprint, sw.fingerprint, se.fingerprint
+        )
         instance._next_gen = None
         instance._leap_gen = None
+        instance._step_gen = None
+        instance._stamp = cls.epoch
+        if instance.level == 1:
+            # live neighbor cells packed as nw, ne, sw, se from the lowest bit up
+            instance._bits = nw._bit | ne._bit << 1 | sw._bit << 2 | se._bit << 3
+        if cls.STATS is not None:
+            cls.STATS.created[instance.level] += 1
         return instance
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "ALL_NODES" in cls.__dict__:
+            cls._STORE_CLS = cls
+            # node classes of the universes sharing this store, see Universe
+            cls._SHARERS = weakref.WeakSet()
+
     @classmethod
     def empty(cls, level):
         if level == 0:
-            return State.DEAD
+            return cls._LEAVES[0]
         n_empty = cls.ALL_EMPTY.get(level, None)
         if n_empty is not None:
             return n_empty
-        n_empty = cls(
-            cls.empty(level - 1), cls.empty(level - 1), cls.empty(level - 1), cls.empty(level - 1)
-        )
-        cls.ALL_EMPTY[level] = n_empty
+        # build up from the highest empty node that already exists
+        sublevel = level - 1
+        while sublevel > 0 and sublevel not in cls.ALL_EMPTY:
+            sublevel -= 1
+        n_empty = cls.empty(sublevel)
+        for sublevel in range(sublevel + 1, level + 1):
+            n_empty = cls(n_empty, n_empty, n_empty, n_empty)
+            cls.ALL_EMPTY[sublevel] = n_empty
         return n_empty
 
     @classmethod
-    def from_state_map(cls, state_map):
-        if state_map.level == 0:
-            return state_map.val
-        return cls(
-            cls.from_state_map(state_map.nw), cls.from_state_map(state_map.ne),
-            cls.from_state_map(state_map.sw), cls.from_state_map(state_map.se)
+    def collect(cls, roots, max_memo_age=None):
+        """Mark-and-sweep ALL_NODES, keeping only nodes reachable from roots
+
+        Memoized results are followed during marking if they were used within the last
+        max_memo_age collections (all of them if max_memo_age is None), otherwise evicted.
+        """
+        start = time.perf_counter()
+        epoch = cls.epoch
+        cls.epoch += 1
+        # memo tables of sharing universes are not aged, only dropped with their nodes
+        tables = []
+        if max_memo_age is None or max_memo_age >= 0:
+            tables = [memos for sharer in cls._SHARERS for memos in sharer._MEMOS.values()]
+        marked = set()
+        stack = [node for node in roots if node.level > 0]
+        stack.extend(cls.ALL_EMPTY.values())
+        while stack:
+            node = stack.pop()
+            if node in marked:
+                continue
+            marked.add(node)
+            if node.level > 1:
+                stack.extend((node.nw, node.ne, node.sw, node.se))
+            if max_memo_age is None or epoch - node._stamp <= max_memo_age:
+                for result in (node._next_gen, node._leap_gen):
+                    if result is not None and result.level > 0:
+                        stack.append(result)
+                if node._step_gen is not None:
+                    stack.extend(node._step_gen.values())
+            for memos in tables:
+                result = memos.get(node, None)
+                if result is not None:
+                    stack.append(result)
+        memos_dropped = 0
+        for node in marked:
+            if node._next_gen is not None and node._next_gen not in marked:
+                node._next_gen = None
+                memos_dropped += 1
+            if node._leap_gen is not None and node._leap_gen not in marked:
+                node._leap_gen = None
+                memos_dropped += 1
+            if node._step_gen is not None:
+                steps = {
+                    power: result
+                    for power, result in node._step_gen.items()
+                    if result in marked
+                }
+                memos_dropped += len(node._step_gen) - len(steps)
+                node._step_gen = steps or None
+        for sharer in cls._SHARERS:
+            for memos in sharer._MEMOS.values():
+                kept = {
+                    node: result
+                    for node, result in memos.items()
+                    if node in marked and result in marked
+                }
+                memos_dropped += len(memos) - len(kept)
+                memos.clear()
+                memos.update(kept)
+        collected = len(cls.ALL_NODES) - len(marked)
+        cls.ALL_NODES = {(node.nw, node.ne, node.sw, node.se): node for node in marked}
+        cls.last_collect = CollectStats(
+            len(marked), collected, memos_dropped, time.perf_counter() - start
         )
+        return cls.last_collect
+
+    @classmethod
+    def maybe_collect(cls, roots):
+        """Collect if ALL_NODES has grown past MAX_NODES
+
+        Memoized results are evicted progressively harder until the store fits the budget
+        or only nodes reachable from roots remain.
+        """
+        if cls.MAX_NODES is None or len(cls.ALL_NODES) <= cls.MAX_NODES:
+            return None
+        roots = tuple(roots)
+        passes = [cls.collect(roots, cls.MEMO_MAX_AGE)]
+        for max_memo_age in (0, -1):
+            if len(cls.ALL_NODES) <= cls.MAX_NODES:
+                break
+            passes.append(cls.collect(roots, max_memo_age))
+        cls.last_collect = CollectStats(
+            passes[-1].kept, *(sum(field) for field in tuple(zip(*passes))[1:])
+        )
+        return cls.last_collect
+
+    @classmethod
+    def from_state_map(cls, state_map):
+        """Build a node from a StateMap, in one pass over its cells"""
+        return cls._from_grid(state_map.rows)
+
+    @classmethod
+    def _from_grid(cls, grid):
+        """Build a node from a square power of two grid of same level nodes or cells
+
+        Each level is built from the one below two rows at a time, so every node or cell is
+        visited once.
+        """
+        while len(grid) > 1:
+            grid = [
+                list(map(cls, north[0::2], north[1::2], south[0::2], south[1::2]))
+                for north, south in zip(grid[0::2], grid[1::2])
+            ]
+        return grid[0][0]
+
+    def _grid(self, level):
+        """Rows of the subnodes of the given level, from the nw corner down to the se corner"""
+        grid = [[self]]
+        for _ in range(self.level - level):
+            expanded = []
+            for row in grid:
+                north = [None] * 2 * len(row)
+                south = [None] * 2 * len(row)
+                north[0::2] = map(_NW, row)
+                north[1::2] = map(_NE, row)
+                south[0::2] = map(_SW, row)
+                south[1::2] = map(_SE, row)
+                expanded.append(north)
+                expanded.append(south)
+            grid = expanded
+        return grid
 
     def as_state_map(self, state_map=None):
-        if state_map is not None and state_map.level != self.level:
-            raise ValueError("state_map level does not match")
-        if self.level == 1:
-            if state_map is None:
-                return StateMap(self.level, [[self.nw, self.ne], [self.sw, self.se]])
-            state_map.rows[state_map.row_slice.start][state_map.col_slice.start] = self.nw
-            state_map.rows[state_map.row_slice.start][state_map.col_slice.start + 1] = self.ne
-            state_map.rows[state_map.row_slice.start + 1][state_map.col_slice.start] = self.sw
-            state_map.rows[state_map.row_slice.start + 1][state_map.col_slice.start + 1] = self.se
-            return state_map
+        """Return the cells as a new StateMap, or write them into state_map in place"""
         if state_map is None:
-            empty_rows = [[State.DEAD for _ in range(2**self.level)] for _ in range(2**self.level)]
-            state_map = StateMap(self.level, empty_rows)
-        self.nw.as_state_map(state_map.nw)
-        self.ne.as_state_map(state_map.ne)
-        self.sw.as_state_map(state_map.sw)
-        self.se.as_state_map(state_map.se)
+            rows = self._grid(0)
+            return StateMap.from_buffer(self.level, [cell for row in rows for cell in row])
+        if state_map.level != self.level:
+            raise ValueError("state_map level does not match")
+        cells, stride = state_map.cells, state_map.stride
+        start = state_map.row * stride + state_map.col
+        size = state_map.size
+        for offset, row in zip(range(start, start + size * stride, stride), self._grid(0)):
+            cells[offset:offset + size] = row
         return state_map
 
+    @classmethod
+    def from_cells(cls, cells, level=None):
+        """Build a node from the (x, y) of its live cells, x to the east and y to the south
+
+        (0, 0) is the nw corner. cells can also be a mapping from (x, y) to an integer state,
+        for rules with more than two states. level defaults to the smallest one that fits every
+        cell. Built bottom up, so the cost grows with the number of cells and not with the area.
+        """
+        if isinstance(cells, collections.abc.Mapping):
+            cells = cells.items()
+        else:
+            cells = ((cell, 1) for cell in cells)
+        nodes = {}
+        for (x, y), state in cells:
+            if x < 0 or y < 0:
+                raise ValueError("Cell coordinates cannot be negative")
+            if not 0 <= state < len(cls._LEAVES):
+                raise ValueError("No state {} in this rule".format(state))
+            if state:
+                nodes[(x, y)] = cls._LEAVES[state]
+        fit_level = max(1, max((max(x, y) for x, y in nodes), default=0).bit_length())
+        if level is None:
+            level = fit_level
+        elif level < fit_level:
+            raise ValueError("Cells do not fit in a level {} node".format(level))
+        for sublevel in range(level):
+            empty = cls.empty(sublevel)
+            parents = {(x >> 1, y >> 1) for x, y in nodes}
+            nodes = {
+                (x, y): cls(
+                    nodes.get((2 * x, 2 * y), empty), nodes.get((2 * x + 1, 2 * y), empty),
+                    nodes.get((2 * x, 2 * y + 1), empty), nodes.get((2 * x + 1, 2 * y + 1), empty)
+                )
+                for x, y in parents
+            }
+        return nodes.get((0, 0), cls.empty(level))
+
+    def iter_live_cells(self):
+        """Yield the (x, y) of every live cell, with (0, 0) the nw corner
+
+        Empty subtrees are skipped without being walked.
+        """
+        stack = [(self, 0, 0)]
+        while stack:
+            node, x, y = stack.pop()
+            if node.level == 1:
+                bits = node._bits
+                if bits & 1:
+                    yield x, y
+                if bits & 2:
+                    yield x + 1, y
+                if bits & 4:
+                    yield x, y + 1
+                if bits & 8:
+                    yield x + 1, y + 1
+            elif node is not self.empty(node.level):
+                half = 2**(node.level - 1)
+                stack.append((node.se, x + half, y + half))
+                stack.append((node.sw, x, y + half))
+                stack.append((node.ne, x + half, y))
+                stack.append((node.nw, x, y))
+
+    def iter_cells(self):
+        """Yield (x, y, state) for every cell not in state 0, like iter_live_cells()"""
+        for x, y in self.iter_live_cells():
+            yield x, y, 1
+
+    def get_region(self, x0, y0, x1, y1):
+        """Return the cells in x0 <= x < x1, y0 <= y < y1 as bytes, row by row
+
+        Each cell is one byte holding its state, 1 if alive and 0 if dead for two-state rules,
+        and cells outside the node are dead.
+        Only subtrees with live cells that overlap the region are visited.
+        """
+        width = max(0, x1 - x0)
+        region = bytearray(width * max(0, y1 - y0))
+        stack = [(self, 0, 0)]
+        while stack:
+            node, x, y = stack.pop()
+            size = 2**node.level
+            if not node.population or x >= x1 or y >= y1 or x + size <= x0 or y + size <= y0:
+                continue
+            if node.level == 0:
+                region[(y - y0) * width + x - x0] = node.value
+                continue
+            half = size // 2
+            stack.append((node.nw, x, y))
+            stack.append((node.ne, x + half, y))
+            stack.append((node.sw, x, y + half))
+            stack.append((node.se, x + half, y + half))
+        return bytes(region)
+
+    def render(self, viewport, scale=0):
+        """Return live cell counts per pixel of viewport as a list of rows
+
+        viewport is (x0, y0, x1, y1) in cells and every pixel is a square of 2 ** scale cells,
+        the first one with its nw corner at (x0, y0). A subtree that falls in a single pixel is
+        counted by its cached population without descending into it, so rendering an aligned
+        viewport costs O(pixels * level).
+        """
+        x0, y0, x1, y1 = viewport
+        pixel = 2**scale
+        width = max(0, -(-(x1 - x0) // pixel))
+        height = max(0, -(-(y1 - y0) // pixel))
+        pixels = [[0] * width for _ in range(height)]
+        stack = [(self, 0, 0)]
+        while stack:
+            node, x, y = stack.pop()
+            size = 2**node.level
+            if not node.population or x >= x1 or y >= y1 or x + size <= x0 or y + size <= y0:
+                continue
+            col, row = (x - x0) // pixel, (y - y0) // pixel
+            last_col, last_row = (x + size - 1 - x0) // pixel, (y + size - 1 - y0) // pixel
+            inside = x >= x0 and y >= y0 and x + size <= x1 and y + size <= y1
+            if inside and col == last_col and row == last_row:
+                pixels[row][col] += node.population
+                continue
+            half = size // 2
+            stack.append((node.nw, x, y))
+            stack.append((node.ne, x + half, y))
+            stack.append((node.sw, x, y + half))
+            stack.append((node.se, x + half, y + half))
+        return pixels
+
+    def flatten(self):
+        """Return the subtree as a list of child id tuples, children before their parents
+
+        Ids below len(_LEAVES) stand for leaf states, 0 and 1 being State.DEAD and State.ALIVE
+        for two-state rules. The tuple at index i is the node with id i + len(_LEAVES), and
+        self is last.
+        """
+        ids = {leaf: state for state, leaf in enumerate(self._LEAVES)}
+        table = []
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            if node in ids:
+                stack.pop()
+                continue
+            children = (node.nw, node.ne, node.sw, node.se)
+            missing = [child for child in children if child not in ids]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            ids[node] = len(table) + len(self._LEAVES)
+            table.append(tuple(ids[child] for child in children))
+        return table
+
+    @classmethod
+    def unflatten(cls, table):
+        """Build the canonical node for a table returned by flatten()"""
+        nodes = list(cls._LEAVES)
+        for children in table:
+            nodes.append(cls(*(nodes[child] for child in children)))
+        return nodes[-1]
+
     def _neighbors_alive(self):
         """Evaluate how many neighbors are alive for a level 2 node"""
         if self.level != 2:
@@ -170,6 +733,29 @@ class Node:
             return True
         return False
 
+    @classmethod
+    def _leaf_table(cls):
+        """Table of packed 2x2 next generation centers indexed by packed 4x4 cells
+
+        A 4x4 node is indexed by its level 1 children's packed bits, nw in the lowest 4 bits
+        up to se in the highest.
+        """
+        if cls._LEAF_RULES[0] is cls.RULE_BIRTH and cls._LEAF_RULES[1] is cls.RULE_SURVIVE:
+            return cls._LEAF_TABLE
+        born = tuple(cls._eval_rule(State.DEAD, alive) for alive in range(9))
+        survives = tuple(cls._eval_rule(State.ALIVE, alive) for alive in range(9))
+        table = []
+        for cells in range(1 << 16):
+            result = 0
+            for out_bit, (center, neighbors) in enumerate(_LEAF_NEIGHBORHOODS):
+                alive = bin(cells & neighbors).count("1")
+                if (survives if cells >> center & 1 else born)[alive]:
+                    result |= 1 << out_bit
+            table.append(result)
+        cls._LEAF_TABLE = table
+        cls._LEAF_RULES = (cls.RULE_BIRTH, cls.RULE_SURVIVE)
+        return table
+
     @classmethod
     def centered_horizontal(cls, west, east):
         return cls(west.ne, east.nw, west.se, east.sw)
@@ -189,77 +775,750 @@ class Node:
         se = self.__class__(self.se, empty, empty, empty)
         return self.__class__(nw, ne, sw, se)
 
-    def shrink(self):
+    def _border_empty(self):
+        """Whether everything outside the centered subnode is empty"""
         should_be_empty = (
             self.nw.nw, self.nw.ne, self.nw.sw, self.ne.nw, self.ne.ne, self.ne.se, self.sw.nw,
             self.sw.sw, self.sw.se, self.se.ne, self.se.sw, self.se.se
         )
-        for node in should_be_empty:
-            if node is not self.empty(self.level - 2):
-                raise ValueError("Cannot shrink")
+        empty = self.empty(self.level - 2)
+        return all(node is empty for node in should_be_empty)
+
+    def shrink(self):
+        if not self._border_empty():
+            raise ValueError("Cannot shrink")
         return self.centered_subnode()
 
+    def _padded(self):
+        """Whether all live cells are within the center quarter of the node"""
+        return self._border_empty() and self.centered_subnode()._border_empty()
+
+    def _nine_subnodes(self):
+        """The nine overlapping subnodes one level down, row by row from nw to se"""
+        return (
+            self.nw,
+            self.centered_horizontal(self.nw, self.ne),
+            self.ne,
+            self.centered_vertical(self.nw, self.sw),
+            self.centered_subnode(),
+            self.centered_vertical(self.ne, self.se),
+            self.sw,
+            self.centered_horizontal(self.sw, self.se),
+            self.se,
+        )
+
+    def _get_memo(self, power):
+        """Memoized result 2 ** power generations ahead, or None"""
+        if power == self.level - 2:
+            memo = self._leap_gen
+        elif power == 0:
+            memo = self._next_gen
+        elif self._step_gen is not None:
+            memo = self._step_gen.get(power, None)
+        else:
+            return None
+        if memo is not None:
+            self._stamp = self.__class__.epoch
+        return memo
+
+    def _set_memo(self, power, result):
+        if power == self.level - 2:
+            self._leap_gen = result
+        if power == 0:
+            self._next_gen = result
+        elif power != self.level - 2:
+            if self._step_gen is None:
+                self._step_gen = {}
+            self._step_gen[power] = result
+        self._stamp = self.__class__.epoch
+        return result
+
+    @classmethod
+    def _base_case(cls, node):
+        """Next generation of a level 2 node, looked up in the leaf table"""
+        bits = cls._leaf_table()[
+            node.nw._bits | node.ne._bits << 4 | node.sw._bits << 8 | node.se._bits << 12
+        ]
+        return cls(*cls._LEAF_CELLS[bits])
+
+    @classmethod
+    def _evaluate(cls, root, power):
+        """Return the centered subnode of root 2 ** power generations ahead under cls's rule"""
+        if (
+            cls._STORE_CLS is cls and cls.STATS is None and cls.TRACE is None and
+            cls.DENSE_LEVEL is None and cls.SNAPSHOT is None
+        ):
+            return cls._evaluate_plain(root, power)
+        try:
+            # without a chunk size the evaluation never yields
+            next(cls._evaluation(root, power, None))
+        except StopIteration as stop:
+            return stop.value
+        raise RuntimeError("evaluation yielded without a chunk size")
+
+    @classmethod
+    def _evaluate_plain(cls, root, power):
+        """_evaluation() without chunks or hooks, for a class keeping memos in its nodes' slots
+
+        Frames are (node, parts, dest, index), with parts None until the nine subresults are
+        pushed, then the nine subresults and then the four quadrants. A frame's power is the
+        smaller of power and its level - 2, so frames at or below level power + 2 are leaps and
+        read and write _leap_gen directly. Subnodes are canonicalized with a lookup in
+        ALL_NODES, and only new ones go through the constructor.
+        """
+        epoch = cls.epoch
+        get = cls.ALL_NODES.get
+        base_case = cls._base_case
+        leap_level = power + 2
+        memo = cls._get_memo(root, power)
+        if memo is not None:
+            return memo
+        result = [None]
+        stack = [(root, None, result, 0)]
+        pop, push = stack.pop, stack.append
+        while stack:
+            node, parts, dest, index = pop()
+            level = node.level
+            if parts is None:
+                if level == 2:
+                    memo = base_case(node)
+                    node._leap_gen = memo
+                    if power == 0:
+                        node._next_gen = memo
+                    node._stamp = epoch
+                    dest[index] = memo
+                    continue
+                nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+                key = (nw.ne, ne.nw, nw.se, ne.sw)
+                n01 = get(key)
+                if n01 is None:
+                    n01 = cls(*key)
+                key = (nw.sw, nw.se, sw.nw, sw.ne)
+                n10 = get(key)
+                if n10 is None:
+                    n10 = cls(*key)
+                key = (nw.se, ne.sw, sw.ne, se.nw)
+                n11 = get(key)
+                if n11 is None:
+                    n11 = cls(*key)
+                key = (ne.sw, ne.se, se.nw, se.ne)
+                n12 = get(key)
+                if n12 is None:
+                    n12 = cls(*key)
+                key = (sw.ne, se.nw, sw.se, se.sw)
+                n21 = get(key)
+                if n21 is None:
+                    n21 = cls(*key)
+                nine = (nw, n01, ne, n10, n11, n12, sw, n21, se)
+                if level <= leap_level:
+                    # the nine subresults are leaps themselves
+                    parts = [None] * 9
+                    push((node, parts, dest, index))
+                    for sub_index in range(8, -1, -1):
+                        subnode = nine[sub_index]
+                        memo = subnode._leap_gen
+                        if memo is None:
+                            push((subnode, None, parts, sub_index))
+                        else:
+                            subnode._stamp = epoch
+                            parts[sub_index] = memo
+                    continue
+                # the nine subresults are the same generation, only the quadrants are stepped
+                parts = [subnode.centered_subnode() for subnode in nine]
+            if len(parts) == 9:
+                n00, n01, n02, n10, n11, n12, n20, n21, n22 = parts
+                quadrants = (
+                    (n00, n01, n10, n11),
+                    (n01, n02, n11, n12),
+                    (n10, n11, n20, n21),
+                    (n11, n12, n21, n22),
+                )
+                parts = [None] * 4
+                push((node, parts, dest, index))
+                for sub_index in range(3, -1, -1):
+                    key = quadrants[sub_index]
+                    subnode = get(key)
+                    if subnode is None:
+                        subnode = cls(*key)
+                    if level - 1 <= leap_level:
+                        memo = subnode._leap_gen
+                    else:
+                        memo = cls._get_memo(subnode, power)
+                    if memo is None:
+                        push((subnode, None, parts, sub_index))
+                    else:
+                        subnode._stamp = epoch
+                        parts[sub_index] = memo
+                continue
+            key = tuple(parts)
+            memo = get(key)
+            if memo is None:
+                memo = cls(*key)
+            if level <= leap_level:
+                node._leap_gen = memo
+            elif power == 0:
+                node._next_gen = memo
+            else:
+                cls._set_memo(node, power, memo)
+            node._stamp = epoch
+            dest[index] = memo
+        return result[0]
+
+    @classmethod
+    def _evaluation(cls, root, power, chunk_size):
+        """Generator evaluating the centered subnode of root 2 ** power generations ahead
+
+        Evaluated with an explicit stack instead of recursion. A frame is revisited once its
+        nine overlapping subresults are known, and again once the four quadrants of its result
+        are known. Subresults that are already memoized are filled in without pushing a frame.
+        With a chunk_size, a Progress is yielded every chunk_size frames and once more with the
+        result, which is also the generator's return value. Memos and the base case are always
+        looked up through cls, since root can be a node of another universe sharing the store.
+        """
+        stats = cls.STATS
+        trace = cls.TRACE
+        dense_level = cls.DENSE_LEVEL
+        snapshot = cls.SNAPSHOT
+        dense_levels = ()
+        if dense_level is not None:
+            # optional NumPy dependency
+            from hashlife.dense import dense_step  # pylint: disable=import-outside-toplevel
+            # level 2 is always the base case
+            dense_levels = range(3, dense_level + 1)
+            if cls.DENSE_HIT_RATE is not None:
+                if stats is None:
+                    raise ValueError("DENSE_HIT_RATE needs STATS to measure memo hit rates")
+                rates = {level: stats.memo_hit_rate(level) for level in dense_levels}
+                dense_levels = frozenset(
+                    level for level, rate in rates.items()
+                    if rate is not None and rate < cls.DENSE_HIT_RATE
+                )
+        memo = cls._get_memo(root, power)
+        if memo is not None:
+            if stats is not None:
+                stats.memo_hits[root.level] += 1
+                if stats.hook is not None:
+                    stats.hook(stats)
+            if chunk_size is not None:
+                yield Progress(0, 0, memo)
+            return memo
+        result = [None]
+        stack = [(root, power, 0, None, result, 0)]
+        frames = 0
+        if stats is not None:
+            timed_level = root.level
+            timed_start = time.perf_counter()
+        if trace is not None:
+            where = {id(result): ((), None)}
+            traced_stack = None
+            traced_start = time.perf_counter()
+        while stack:
+            if chunk_size is not None:
+                frames += 1
+                if frames % chunk_size == 0:
+                    # every memo set so far is complete, so stopping here leaves them valid
+                    yield Progress(frames, len(stack), None)
+                    if stats is not None:
+                        timed_start = time.perf_counter()
+                    if trace is not None:
+                        traced_start = time.perf_counter()
+            node, power, stage, parts, dest, index = stack.pop()
+            if stats is not None:
+                now = time.perf_counter()
+                stats.seconds[timed_level] += now - timed_start
+                timed_level, timed_start = node.level, now
+            if trace is not None:
+                now = time.perf_counter()
+                if traced_stack is not None:
+                    trace.seconds[traced_stack] += now - traced_start
+                traced_stack = _trace_stack(where, node, stage, parts, dest, index)
+                traced_start = now
+            leap = power == node.level - 2
+            if stage == 0:
+                if snapshot is not None:
+                    memo = snapshot.memo(node, power)
+                    if memo is not None:
+                        if stats is not None:
+                            stats.memo_hits[node.level] += 1
+                        dest[index] = cls._set_memo(node, power, memo)
+                        continue
+                if stats is not None:
+                    stats.memo_misses[node.level] += 1
+                if trace is not None:
+                    trace.misses[traced_stack] += 1
+                if node.level == 2:
+                    dest[index] = cls._set_memo(node, power, cls._base_case(node))
+                    continue
+                if node.level in dense_levels:
+                    dest[index] = cls._set_memo(node, power, dense_step(node, power, cls))
+                    continue
+                if leap:
+                    # the nine subresults are leaps themselves
+                    parts = [None] * 9
+                    if trace is not None:
+                        where[id(parts)] = (traced_stack, 9)
+                    stack.append((node, power, 1, parts, dest, index))
+                    cls._push_frames(stack, node._nine_subnodes(), power - 1, parts)
+                    continue
+                # the nine subresults are the same generation, only the quadrants are stepped
+                parts = [subnode.centered_subnode() for subnode in node._nine_subnodes()]
+                stage = 1
+            if stage == 1:
+                n00, n01, n02, n10, n11, n12, n20, n21, n22 = parts
+                quadrants = (
+                    cls(n00, n01, n10, n11),
+                    cls(n01, n02, n11, n12),
+                    cls(n10, n11, n20, n21),
+                    cls(n11, n12, n21, n22),
+                )
+                parts = [None] * 4
+                if trace is not None:
+                    where[id(parts)] = (traced_stack, 4)
+                stack.append((node, power, 2, parts, dest, index))
+                cls._push_frames(stack, quadrants, power - 1 if leap else power, parts)
+                continue
+            dest[index] = cls._set_memo(node, power, cls(*parts))
+        if stats is not None:
+            stats.seconds[timed_level] += time.perf_counter() - timed_start
+            if stats.hook is not None:
+                stats.hook(stats)
+        if trace is not None:
+            trace.seconds[traced_stack] += time.perf_counter() - traced_start
+        if chunk_size is not None:
+            yield Progress(frames, 0, result[0])
+        return result[0]
+
+    @classmethod
+    def _push_frames(cls, stack, nodes, power, parts):
+        """Fill parts from memoized results, pushing frames for the rest in nw to se order"""
+        for index in range(len(nodes) - 1, -1, -1):
+            memo = cls._get_memo(nodes[index], power)
+            if memo is not None:
+                if cls.STATS is not None:
+                    cls.STATS.memo_hits[nodes[index].level] += 1
+                parts[index] = memo
+            else:
+                stack.append((nodes[index], power, 0, None, parts, index))
+
     def next_gen(self):
-        if self._next_gen is not None:
-            return self._next_gen
         if self.level == 1:
             raise ValueError("Cannot call next_gen() on a level 1 node")
-        if self.level == 2:
-            # base case simulation
-            nw_alive, ne_alive, sw_alive, se_alive = self._neighbors_alive()
-            n_next = self.__class__(
-                State(self._eval_rule(self.nw.se, nw_alive)),
-                State(self._eval_rule(self.ne.sw, ne_alive)),
-                State(self._eval_rule(self.sw.ne, sw_alive)),
-                State(self._eval_rule(self.se.nw, se_alive)),
-            )
-        else:
-            # recursive simulation
-            n00 = self.nw.centered_subnode()
-            n01 = self.centered_horizontal(self.nw, self.ne).centered_subnode()
-            n02 = self.ne.centered_subnode()
-            n10 = self.centered_vertical(self.nw, self.sw).centered_subnode()
-            n11 = self.centered_subnode().centered_subnode()
-            n12 = self.centered_vertical(self.ne, self.se).centered_subnode()
-            n20 = self.sw.centered_subnode()
-            n21 = self.centered_horizontal(self.sw, self.se).centered_subnode()
-            n22 = self.se.centered_subnode()
-            n_next = self.__class__(
-                self.__class__(n00, n01, n10, n11).next_gen(),
-                self.__class__(n01, n02, n11, n12).next_gen(),
-                self.__class__(n10, n11, n20, n21).next_gen(),
-                self.__class__(n11, n12, n21, n22).next_gen(),
-            )
-        self._next_gen = n_next
-        return n_next
+        return self._evaluate(self, 0)
 
     def leap_gen(self):
-        if self._leap_gen is not None:
-            return self._leap_gen
         if self.level == 1:
             raise ValueError("Cannot call next_gen() on a level 1 node")
-        if self.level == 2:
-            # base case simulation
-            n_leap = self.next_gen()
+        return self._evaluate(self, self.level - 2)
+
+    def step_gen(self, power):
+        """Return the centered subnode 2 ** power generations ahead
+
+        power 0 is next_gen() and power level - 2 is leap_gen(), other step sizes are memoized
+        per power.
+        """
+        if not 0 <= power <= self.level - 2:
+            raise ValueError("power must be between 0 and level - 2")
+        return self._evaluate(self, power)
+
+    def iter_step_gen(self, power, chunk_size=1000):
+        """Generator version of step_gen() doing at most chunk_size frames between yields
+
+        Yields a Progress with the frames evaluated so far and the frames still pending, the
+        last one also carrying the result. Stopping early keeps every memoized result computed
+        so far, so a later call resumes from them.
+        """
+        if not 0 <= power <= self.level - 2:
+            raise ValueError("power must be between 0 and level - 2")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        return self._evaluation(self, power, chunk_size)
+
+    @classmethod
+    def rule_string(cls):
+        """The rule in the notation Universe() takes"""
+        return format_rule(cls.RULE_BIRTH, cls.RULE_SURVIVE)
+
+    def __bool__(self):
+        raise RuntimeError("Cannot evaluate state of Node")
+
+
+Node._STORE_CLS = Node
+Node._SHARERS = weakref.WeakSet()
+
+
+class Topology(enum.Enum):
+    """Edges of the universe, see advance()"""
+    # unbounded, nodes grow as needed
+    PLANE = "plane"
+    # the node is the whole universe with opposite edges joined
+    TORUS = "torus"
+    # the node is the whole universe and cells outside it are always dead
+    BOUNDED = "bounded"
+
+
+def _repeat(step, node, count, node_cls, roots):
+    """Apply step to node count times, skipping whole cycles once a node repeats
+
+    roots are kept along with the current and seen nodes when the store is collected.
+    """
+    seen = {}
+    while count:
+        if seen is not None:
+            if node in seen:
+                count %= seen[node] - count
+                seen = None
+                continue
+            seen[node] = count
+        node = step(node)
+        count -= 1
+        node_cls.maybe_collect(itertools.chain((node,), roots, seen or ()))
+    return node
+
+
+def _torus_step(node, power, node_cls):
+    """node as a torus 2 ** power generations ahead, for power up to node.level - 1"""
+    # a 2x2 tiling is periodic, so its centered result is exact, shifted by half the node
+    result = node_cls._evaluate(node_cls(node, node, node, node), power)
+    return node_cls(result.se, result.sw, result.ne, result.nw)
+
+
+def advance(node, generations, topology=Topology.PLANE, node_cls=None, roots=()):
+    """Return node advanced by any number of generations
+
+    On the plane, generations is split into power of two steps. node is expanded before each
+    step so no live cell can leave it, and the result is shrunk as far as possible afterwards.
+    The result stays centered on the same point as node.
+
+    With Topology.TORUS or Topology.BOUNDED node is the whole universe and the result has the
+    same level. A torus is stepped by up to half its size at a time as a 2x2 tiling of itself,
+    a bounded universe one generation at a time with a dead border. Both skip ahead once the
+    universe repeats.
+
+    node_cls is the class whose rule and memoized results are used, node's own class by
+    default. All topologies share them, and call node_cls.maybe_collect() between steps, so
+    MAX_NODES bounds the store during long advances. node and any other roots the caller still
+    compares by identity stay canonical through those collections.
+    """
+    if generations < 0:
+        raise ValueError("Cannot advance a negative number of generations")
+    topology = Topology(topology)
+    if node_cls is None:
+        node_cls = node.__class__
+    roots = (node,) + tuple(roots)
+    if topology is not Topology.PLANE:
+        if node.level < 1:
+            raise ValueError("Cannot advance a level 0 universe")
+        if topology is Topology.BOUNDED:
+            return _repeat(
+                lambda node: node_cls._evaluate(node.expand(), 0), node, generations, node_cls,
+                roots
+            )
+        top = node.level - 1
+        node = _repeat(
+            lambda node: _torus_step(node, top, node_cls), node, generations >> top, node_cls,
+            roots
+        )
+        for power in range(top):
+            if generations >> power & 1:
+                node = _torus_step(node, power, node_cls)
+                node_cls.maybe_collect((node,) + roots)
+        return node
+    power = 0
+    while generations:
+        if generations & 1:
+            # a step of 2 ** power generations needs 2 ** power cells of padding on each side
+            while node.level < power + 3 or not node._padded():
+                node = node.expand()
+            node = node_cls._evaluate(node, power)
+            node_cls.maybe_collect((node,) + roots)
+        generations >>= 1
+        power += 1
+    while node.level > 1 and node._border_empty():
+        node = node.centered_subnode()
+    return node
+
+
+def parse_rule(rule):
+    """Parse a Life-like rule in B/S notation such as "B3/S23" into birth and survive sets"""
+    parts = rule.strip().upper().split("/")
+    if len(parts) != 2 or not parts[0].startswith("B") or not parts[1].startswith("S"):
+        raise ValueError("Rule must be in B/S notation, got {!r}".format(rule))
+    counts = []
+    for part in parts:
+        if not all(char in "012345678" for char in part[1:]):
+            raise ValueError("Rule must be in B/S notation, got {!r}".format(rule))
+        counts.append(frozenset(int(char) for char in part[1:]))
+    return tuple(counts)
+
+
+def format_rule(birth, survive):
+    return "B{}/S{}".format(
+        "".join(str(alive) for alive in sorted(birth)),
+        "".join(str(alive) for alive in sorted(survive)),
+    )
+
+
+def parse_generations_rule(rule):
+    """Parse a Generations rule such as "B2/S/C3" into birth, survive and the state count"""
+    parts = rule.strip().upper().split("/")
+    if len(parts) != 3 or not parts[2].startswith("C") or not parts[2][1:].isdigit():
+        raise ValueError("Rule must be in B/S/C notation, got {!r}".format(rule))
+    birth, survive = parse_rule("/".join(parts[:2]))
+    states = int(parts[2][1:])
+    if not 2 <= states <= len(CELLS):
+        raise ValueError("Generations rules have 2 to {} states".format(len(CELLS)))
+    return birth, survive, states
+
+
+def generations_transitions(birth, survive, states):
+    """Transition table of a Generations rule, see MultiStateNode.TRANSITIONS
+
+    State 1 is alive, and a live cell that does not survive goes through the dying states 2
+    up to states - 1 before it is dead.
+    """
+    dying = 2 % states
+    table = [
+        tuple(int(alive in birth) for alive in range(9)),
+        tuple(1 if alive in survive else dying for alive in range(9)),
+    ]
+    for state in range(2, states):
+        table.append(((state + 1) % states,) * 9)
+    return tuple(table)
+
+
+# empty, electron head, electron tail, conductor
+WIREWORLD_TRANSITIONS = (
+    (0,) * 9,
+    (2,) * 9,
+    (3,) * 9,
+    tuple(1 if heads in (1, 2) else 3 for heads in range(9)),
+)
+
+
+class MultiStateNode(Node):
+    """Node of a rule with up to 256 states, with Cell leaves
+
+    Every cell's next state depends on its state and on how many of its neighbors are in
+    state 1, which covers Generations rules and Wireworld. Canonicalization and evaluation are
+    Node's, only the level 2 base case differs. DENSE_LEVEL is not supported and raises
+    ValueError.
+    """
+    __slots__ = ()
+    ALL_NODES = {}
+    ALL_EMPTY = {}
+    RULE = "B3/S23/C2"
+    # TRANSITIONS[state][neighbors in state 1] is the next state
+    TRANSITIONS = generations_transitions(Node.RULE_BIRTH, Node.RULE_SURVIVE, 2)
+    _LEAVES = CELLS[:2]
+    epoch = 0
+    last_collect = None
+    # neighbor counts of the four centers, 4 bits each, indexed like Node._leaf_table()
+    _COUNT_TABLE = None
+
+    @staticmethod
+    def _count_table():
+        """Table of packed 2x2 center neighbor counts indexed by packed 4x4 cells"""
+        if MultiStateNode._COUNT_TABLE is None:
+            table = []
+            for cells in range(1 << 16):
+                counts = 0
+                for shift, (_, neighbors) in enumerate(_LEAF_NEIGHBORHOODS):
+                    counts |= bin(cells & neighbors).count("1") << 4 * shift
+                table.append(counts)
+            MultiStateNode._COUNT_TABLE = table
+        return MultiStateNode._COUNT_TABLE
+
+    @classmethod
+    def rule_string(cls):
+        return cls.RULE
+
+    def iter_live_cells(self):
+        for x, y, _ in self.iter_cells():
+            yield x, y
+
+    def iter_cells(self):
+        stack = [(self, 0, 0)]
+        while stack:
+            node, x, y = stack.pop()
+            if not node.population:
+                continue
+            if node.level == 0:
+                yield x, y, int(node)
+            else:
+                half = 2**(node.level - 1)
+                stack.append((node.se, x + half, y + half))
+                stack.append((node.sw, x, y + half))
+                stack.append((node.ne, x + half, y))
+                stack.append((node.nw, x, y))
+
+    @classmethod
+    def _base_case(cls, node):
+        """Next generation of a level 2 node from the count table and the rule's transitions"""
+        nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+        counts = cls._count_table()[nw._bits | ne._bits << 4 | sw._bits << 8 | se._bits << 12]
+        table = cls.TRANSITIONS
+        return cls(
+            CELLS[table[nw.se][counts & 15]],
+            CELLS[table[ne.sw][counts >> 4 & 15]],
+            CELLS[table[sw.ne][counts >> 8 & 15]],
+            CELLS[table[se.nw][counts >> 12]],
+        )
+
+    @classmethod
+    def _evaluation(cls, root, power, chunk_size):
+        # checked before the generator starts, dense.py only steps two-state rules
+        if cls.DENSE_LEVEL is not None:
+            raise ValueError("DENSE_LEVEL is not supported for rules with more than two states")
+        return super()._evaluation(root, power, chunk_size)
+
+
+class _SharedMemos:
+    """Memo tables keyed by node, for the node class of a universe sharing another's store
+
+    Such a class is never instantiated, its nodes are instances of the class owning the store,
+    whose memo slots hold results under that class's rule.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def _get_memo(cls, node, power):
+        memos = cls._MEMOS.get(power, None)
+        return None if memos is None else memos.get(node, None)
+
+    @classmethod
+    def _set_memo(cls, node, power, result):
+        memos = cls._MEMOS.get(power, None)
+        if memos is None:
+            memos = cls._MEMOS[power] = {}
+        memos[node] = result
+        return result
+
+    @classmethod
+    def collect(cls, roots, max_memo_age=None):
+        cls.last_collect = cls._STORE_CLS.collect(roots, max_memo_age)
+        return cls.last_collect
+
+
+class Universe:
+    """A rule with its own memoized results and leaf table, and a node store
+
+    The universe evaluates nodes with node_cls, a Node subclass with its own rule and the
+    other class level settings, so universes with different rules can run side by side.
+
+    By default the universe has a store of its own, its nodes are instances of node_cls and
+    their next_gen(), leap_gen() and step_gen() follow its rule. With share, a Universe or a
+    node class such as Node, it uses that store instead: structure is shared, so the same cells
+    are the same node in both, and only memoized results are kept apart, in tables of node_cls
+    keyed by node. Shared nodes are instances of the store's class and follow its rule, so they
+    are evaluated through this universe's methods. Collecting sweeps the whole shared store,
+    and keeps the memo tables of every universe sharing it for the nodes that are kept.
+
+    rule is a Life-like rule such as "B3/S23", a Generations rule such as "B2/S/C3", whose
+    nodes are MultiStateNode subclasses, or "WireWorld".
+    """
+
+    def __init__(self, rule="B3/S23", share=None):
+        settings = {
+            "__slots__": (),
+            "MAX_NODES": None,
+            "last_collect": None,
+            "STATS": None,
+            "TRACE": None,
+            "DENSE_LEVEL": None,
+            "DENSE_HIT_RATE": None,
+            "SNAPSHOT": None,
+        }
+        if rule.strip().upper() == "WIREWORLD":
+            self.rule = "WireWorld"
+            base = MultiStateNode
+            settings["TRANSITIONS"] = WIREWORLD_TRANSITIONS
+        elif rule.count("/") == 2:
+            birth, survive, states = parse_generations_rule(rule)
+            self.rule = "{}/C{}".format(format_rule(birth, survive), states)
+            base = MultiStateNode
+            settings["TRANSITIONS"] = generations_transitions(birth, survive, states)
         else:
-            # leap 2 ** (self.level - 2) generations ahead
-            n00 = self.nw.leap_gen()
-            n01 = self.centered_horizontal(self.nw, self.ne).leap_gen()
-            n02 = self.ne.leap_gen()
-            n10 = self.centered_vertical(self.nw, self.sw).leap_gen()
-            n11 = self.centered_subnode().leap_gen()
-            n12 = self.centered_vertical(self.ne, self.se).leap_gen()
-            n20 = self.sw.leap_gen()
-            n21 = self.centered_horizontal(self.sw, self.se).leap_gen()
-            n22 = self.se.leap_gen()
-            n_leap = self.__class__(
-                self.__class__(n00, n01, n10, n11).leap_gen(),
-                self.__class__(n01, n02, n11, n12).leap_gen(),
-                self.__class__(n10, n11, n20, n21).leap_gen(),
-                self.__class__(n11, n12, n21, n22).leap_gen(),
+            birth, survive = parse_rule(rule)
+            self.rule = format_rule(birth, survive)
+            base = Node
+            settings.update(
+                RULE_BIRTH=birth, RULE_SURVIVE=survive, _LEAF_TABLE=None, _LEAF_RULES=(None, None)
             )
-        self._leap_gen = n_leap
-        return n_leap
+        if base is MultiStateNode:
+            settings["RULE"] = self.rule
+            settings["_LEAVES"] = CELLS[:len(settings["TRANSITIONS"])]
+        settings["__qualname__"] = "Universe({!r}).node_cls".format(self.rule)
+        if share is None:
+            settings.update(ALL_NODES={}, ALL_EMPTY={}, epoch=0)
+            self.node_cls = type("Node", (base,), settings)
+            return
+        store_cls = getattr(share, "node_cls", share)._STORE_CLS
+        if store_cls._LEAVES != settings.get("_LEAVES", base._LEAVES):
+            raise ValueError("Universes can only share nodes with the same leaf states")
+        settings["_MEMOS"] = {}
+        self.node_cls = type("Node", (_SharedMemos, store_cls), settings)
+        store_cls._SHARERS.add(self.node_cls)
 
-    def __bool__(self):
-        raise RuntimeError("Cannot evaluate state of Node")
\ No newline at end of file
+    def __repr__(self):
+        return "Universe({!r})".format(self.rule)
+
+    def empty(self, level):
+        return self.node_cls.empty(level)
+
+    def from_cells(self, cells, level=None):
+        return self.node_cls.from_cells(cells, level)
+
+    def from_state_map(self, state_map):
+        return self.node_cls.from_state_map(state_map)
+
+    def adopt(self, node):
+        """Return the node of this universe's store with the same cells as node from any store
+
+        Raises ValueError if node has cells in states this universe's rule does not have.
+        """
+        if type(node) is self.node_cls._STORE_CLS:
+            return node
+        table = node.flatten()
+        leaves, own_leaves = len(node._LEAVES), len(self.node_cls._LEAVES)
+        if leaves != own_leaves:
+            # renumber the nodes after this universe's leaves
+            def renumber(child):
+                if child >= leaves:
+                    return child - leaves + own_leaves
+                if child >= own_leaves:
+                    raise ValueError("Node has states this universe's rule does not have")
+                return child
+
+            table = [tuple(renumber(child) for child in children) for children in table]
+        return self.node_cls.unflatten(table)
+
+    def next_gen(self, node):
+        """Like node.next_gen() under this universe's rule"""
+        return self.step_gen(node, 0)
+
+    def leap_gen(self, node):
+        """Like node.leap_gen() under this universe's rule"""
+        return self.step_gen(node, node.level - 2)
+
+    def step_gen(self, node, power):
+        """Like node.step_gen(power) under this universe's rule"""
+        if not 0 <= power <= node.level - 2:
+            raise ValueError("power must be between 0 and level - 2")
+        return self.node_cls._evaluate(self.adopt(node), power)
+
+    def iter_step_gen(self, node, power, chunk_size=1000):
+        """Like node.iter_step_gen(power, chunk_size) under this universe's rule"""
+        if not 0 <= power <= node.level - 2:
+            raise ValueError("power must be between 0 and level - 2")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        return self.node_cls._evaluation(self.adopt(node), power, chunk_size)
+
+    def advance(self, node, generations, topology=Topology.PLANE, roots=()):
+        return advance(self.adopt(node), generations, topology, self.node_cls, roots)
+
+    def collect(self, roots, max_memo_age=None):
+        return self.node_cls.collect(roots, max_memo_age)
+
+    def maybe_collect(self, roots):
+        return self.node_cls.maybe_collect(roots)
@@ -1,40 +1,562 @@
 """Helper functions for serializing/deserializing simulation state"""
 
 import math
+import mmap
+import operator
+import struct
 
-from hashlife.core import State, StateMap
+from hashlife.core import MultiStateNode, Node, State, StateMap, Universe
 
-def str_to_state_map(strmap, alive_char="1", dead_char="0"):
-    if not strmap:
-        raise ValueError("malformed")
+def _map_bytes(strmap, alive_char, dead_char):
+    """Return the cells of a square string map as bytes, 1 for alive and 0 for dead, and its side
+
+    strmap can be a str or any bytes-like object. Characters other than alive_char and
+    dead_char are dropped, and the map is padded with dead cells to the east and south up to a
+    power of two side of at least 2.
+    """
     if len(alive_char) != 1:
         raise ValueError("alive_char must be length 1")
     if len(dead_char) != 1:
         raise ValueError("dead_char must be length 1")
-    strmap = "".join(char if char in (alive_char, dead_char) else "" for char in strmap)
-    sidelen = math.sqrt(len(strmap))
-    if not sidelen.is_integer():
+    try:
+        alive, dead = alive_char.encode("latin-1"), dead_char.encode("latin-1")
+    except UnicodeEncodeError:
+        # characters beyond latin-1 cannot be translated as bytes, map them one at a time
+        strmap = "".join(
+            "1" if char == alive_char else "0"
+            for char in strmap
+            if char in (alive_char, dead_char)
+        )
+        alive, dead = b"1", b"0"
+    if isinstance(strmap, str):
+        # dropping unencodable characters is fine, they are neither alive_char nor dead_char
+        strmap = strmap.encode("latin-1", "ignore")
+    delete = bytes(char for char in range(256) if char not in (alive[0], dead[0]))
+    # alive_char last, so it wins if both are the same
+    data = bytes(strmap).translate(bytes.maketrans(dead + alive, b"\x00\x01"), delete)
+    side = int(round(math.sqrt(len(data))))
+    if not data or side * side != len(data):
         raise ValueError("malformed")
-    sidelen = int(sidelen)
-    if sidelen % 2 != 0:
-        raise ValueError("malformed")
-    rows = []
-    for row in range(sidelen):
-        str_row = strmap[row * sidelen:(row + 1) * sidelen]
-        rows.append(list(State.ALIVE if char == alive_char else State.DEAD for char in str_row))
-    level = 0
-    while sidelen > 1:
-        sidelen = sidelen // 2
-        level += 1
-    return StateMap(level, rows)
+    size = max(2, 1 << (side - 1).bit_length())
+    if size != side:
+        padding = bytes(size - side)
+        data = b"".join(data[start:start + side] + padding for start in range(0, len(data), side))
+        data += bytes(size * (size - side))
+    return data, size
+
+
+def _map_str(data, alive_char, dead_char):
+    """Inverse of _map_bytes() for bytes of 0 and 1, without the padding"""
+    try:
+        table = bytes.maketrans(b"\x00\x01", (dead_char + alive_char).encode("latin-1"))
+    except (ValueError, UnicodeEncodeError):
+        # multi-character or wide replacements
+        return "".join(map((dead_char, alive_char).__getitem__, data))
+    return data.translate(table).decode("latin-1")
+
+
+def str_to_state_map(strmap, alive_char="1", dead_char="0"):
+    """Parse a square map of alive_char and dead_char, row by row, into a StateMap
+
+    Other characters such as line breaks are ignored. Maps whose side is not a power of two
+    are padded with dead cells to the east and south.
+    """
+    data, size = _map_bytes(strmap, alive_char, dead_char)
+    cells = list(map((State.DEAD, State.ALIVE).__getitem__, data))
+    return StateMap.from_buffer(size.bit_length() - 1, cells)
 
 
 def state_map_to_str(state_map, alive_char="1", dead_char="0"):
-    char_list = []
-    for row in state_map.rows:
-        for state in row:
-            if state.value:
-                char_list.append(alive_char)
+    population = operator.attrgetter("population")
+    data = bytes(map(population, state_map.flat()))
+    return _map_str(data, alive_char, dead_char)
+
+
+def str_to_node(strmap, alive_char="1", dead_char="0", node_cls=Node):
+    """Build a node from a map as taken by str_to_state_map(), without a StateMap
+
+    Cells are packed four to a byte and then sixteen to a lookup key with big integer
+    arithmetic, so the only per cell work is done by bytes methods. 4x4 nodes are built once
+    per distinct key, and the rest of the tree from the grid of 4x4 nodes.
+    """
+    data, size = _map_bytes(strmap, alive_char, dead_char)
+    leaves = node_cls._LEAVES  # pylint: disable=protected-access
+    level1 = [
+        node_cls(leaves[bits & 1], leaves[bits >> 1 & 1], leaves[bits >> 2 & 1], leaves[bits >> 3])
+        for bits in range(16)
+    ]
+
+    def lanes(row):
+        return int.from_bytes(row[0::2], "little"), int.from_bytes(row[1::2], "little")
+
+    # a byte per 2x2 block, cells packed like Node._bits
+    blocks = []
+    for start in range(0, len(data), 2 * size):
+        nw, ne = lanes(data[start:start + size])
+        sw, se = lanes(data[start + size:start + 2 * size])
+        blocks.append((nw | ne << 1 | sw << 2 | se << 3).to_bytes(size // 2, "little"))
+    if size == 2:
+        return level1[blocks[0][0]]
+    # a 16 bit key per 4x4 block, its 2x2 blocks from nw in the lowest 4 bits to se
+    level2 = {}
+    grid = []
+    for north, south in zip(blocks[0::2], blocks[1::2]):
+        nw, ne = lanes(north)
+        sw, se = lanes(south)
+        keys = bytearray(size // 2)
+        keys[0::2] = (nw | ne << 4).to_bytes(size // 4, "little")
+        keys[1::2] = (sw | se << 4).to_bytes(size // 4, "little")
+        keys = struct.unpack("<{}H".format(size // 4), keys)
+        for key in set(keys).difference(level2):
+            level2[key] = node_cls(
+                level1[key & 15], level1[key >> 4 & 15], level1[key >> 8 & 15], level1[key >> 12]
+            )
+        grid.append(list(map(level2.__getitem__, keys)))
+    return node_cls._from_grid(grid)  # pylint: disable=protected-access
+
+
+def _interleave(even, odd):
+    interleaved = bytearray(2 * len(even))
+    interleaved[0::2] = even
+    interleaved[1::2] = odd
+    return bytes(interleaved)
+
+
+def _lane(data, shift, mask):
+    """Every byte of data shifted right and masked, as big integer arithmetic"""
+    return (int.from_bytes(data, "little") >> shift & mask).to_bytes(len(data), "little")
+
+
+def node_to_str(node, alive_char="1", dead_char="0"):
+    """Inverse of str_to_node(), the live cells of node row by row without line breaks
+
+    The tree is walked down to a grid of 4x4 nodes, whose keys are unpacked into cells with
+    big integer arithmetic.
+    """
+    if node.level == 1:
+        bits = node._bits  # pylint: disable=protected-access
+        return _map_str(bytes(bits >> bit & 1 for bit in range(4)), alive_char, dead_char)
+    grid = node._grid(2)  # pylint: disable=protected-access
+    width = len(grid)
+    keys = {}
+    for row in grid:
+        for subnode in set(row).difference(keys):
+            # pylint: disable=protected-access
+            keys[subnode] = (
+                subnode.nw._bits | subnode.ne._bits << 4 | subnode.sw._bits << 8 |
+                subnode.se._bits << 12
+            )
+    low_nibbles = int.from_bytes(b"\x0f" * 2 * width, "little")
+    low_bits = int.from_bytes(b"\x01" * 2 * width, "little")
+    rows = []
+    for row in grid:
+        packed = struct.pack("<{}H".format(width), *map(keys.__getitem__, row))
+        for half in (packed[0::2], packed[1::2]):
+            blocks = _interleave(_lane(half, 0, low_nibbles), _lane(half, 4, low_nibbles))
+            rows.append(_interleave(_lane(blocks, 0, low_bits), _lane(blocks, 1, low_bits)))
+            rows.append(_interleave(_lane(blocks, 2, low_bits), _lane(blocks, 3, low_bits)))
+    return _map_str(b"".join(rows), alive_char, dead_char)
+
+
+def _rle_tag(state):
+    """Return the multi-state RLE tag of state, "." for 0 and "A" to "X", "pA" to "yO" above"""
+    if not state:
+        return "."
+    prefix, index = divmod(state - 1, 24)
+    return ("" if not prefix else chr(ord("p") + prefix - 1)) + chr(ord("A") + index)
+
+
+def _check_rule(rule, node_cls):
+    """Raise ValueError unless the rule named in a pattern file is node_cls's rule"""
+    # Golly appends the grid topology after a colon, as in B3/S23:T100,100
+    rule = rule.split(":")[0].strip()
+    try:
+        rule = Universe(rule).rule
+    except ValueError:
+        raise ValueError("unsupported rule {!r}".format(rule)) from None
+    if rule != node_cls.rule_string():
+        raise ValueError("pattern rule {} differs from {}".format(rule, node_cls.rule_string()))
+
+
+def _iter_rle_cells(fileobj, node_cls):
+    """Yield ((x, y), state) for the cells not in state 0 of an RLE pattern, line by line
+
+    Both two-state "b"/"o" and multi-state "."/"A" to "yO" tags are read.
+    """
+    x = y = 0
+    run = ""
+    prefix = 0
+    for line in fileobj:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("x"):
+            # header, the pattern size is not needed to place cells
+            _, _, rule = line.partition("rule")
+            if rule:
+                _check_rule(rule.partition("=")[2], node_cls)
+            continue
+        for char in line:
+            if char.isdigit():
+                run += char
+                continue
+            if "p" <= char <= "y":
+                prefix = ord(char) - ord("p") + 1
+                continue
+            count = int(run) if run else 1
+            run = ""
+            if prefix and not "A" <= char <= "X":
+                raise ValueError("malformed RLE: unexpected {!r}".format(char))
+            if char in "b.":
+                x += count
+            elif char == "o" or "A" <= char <= "X":
+                state = 1 if char == "o" else 24 * prefix + ord(char) - ord("A") + 1
+                for _ in range(count):
+                    yield (x, y), state
+                    x += 1
+            elif char == "$":
+                x = 0
+                y += count
+            elif char == "!":
+                return
+            elif not char.isspace():
+                raise ValueError("malformed RLE: unexpected {!r}".format(char))
+            prefix = 0
+    raise ValueError("malformed RLE: missing '!'")
+
+
+def read_rle(fileobj, node_cls=Node):
+    """Read a node from an RLE pattern file, with the pattern's top left corner at (0, 0)
+
+    Multi-state patterns need a node_cls with that many states, such as a Universe's. A rule
+    in the header must be node_cls's rule.
+    """
+    return node_cls.from_cells(dict(_iter_rle_cells(fileobj, node_cls)))
+
+
+def write_rle(node, fileobj, line_length=70, node_cls=None):
+    """Write the cells of node as an RLE pattern, cropped to their bounding box
+
+    The header names the rule of node_cls, the class of node by default; pass a Universe's
+    node_cls for nodes of a universe sharing another's store. Patterns of rules with more than
+    two states use the multi-state tags.
+    """
+    node_cls = node_cls or type(node)
+    cells = sorted((y, x, state) for x, y, state in node.iter_cells())
+    if cells:
+        min_x = min(x for _, x, _ in cells)
+        min_y = cells[0][0]
+        width = max(x for _, x, _ in cells) - min_x + 1
+        height = cells[-1][0] - min_y + 1
+    else:
+        min_x = min_y = width = height = 0
+    fileobj.write("x = {}, y = {}, rule = {}\n".format(width, height, node_cls.rule_string()))
+    multi_state = issubclass(node_cls, MultiStateNode)
+    dead = "." if multi_state else "b"
+
+    line = []
+    line_len = 0
+
+    def emit(count, tag):
+        nonlocal line_len
+        token = (str(count) if count > 1 else "") + tag
+        if line_len + len(token) > line_length:
+            fileobj.write("".join(line) + "\n")
+            line.clear()
+            line_len = 0
+        line.append(token)
+        line_len += len(token)
+
+    row, col, run, run_state = 0, 0, 0, 0
+    for y, x, state in cells:
+        y, x = y - min_y, x - min_x
+        if run and (y != row or x != col + run or state != run_state):
+            emit(run, _rle_tag(run_state) if multi_state else "o")
+            col += run
+            run = 0
+        if y != row:
+            emit(y - row, "$")
+            row, col = y, 0
+        if not run:
+            if x != col:
+                emit(x - col, dead)
+            col, run_state = x, state
+        run += 1
+    if run:
+        emit(run, _rle_tag(run_state) if multi_state else "o")
+    emit(1, "!")
+    fileobj.write("".join(line) + "\n")
+
+
+def read_macrocell(fileobj, node_cls=Node):
+    """Read a node from a Golly Macrocell file, sharing subtrees the way the file does
+
+    Nodes are built as their lines are read, so the cost is linear in the file size. A #R rule
+    line must name node_cls's rule.
+    """
+    header = fileobj.readline()
+    if not header.startswith("[M2]"):
+        raise ValueError("malformed Macrocell: missing [M2] header")
+    # node ids start at 1, id 0 is the empty node of whatever level refers to it
+    nodes = [None]
+    for line in fileobj:
+        line = line.strip()
+        if line.startswith("#R"):
+            _check_rule(line[2:], node_cls)
+            continue
+        if not line or line.startswith("#"):
+            continue
+        if line[0] in ".*$":
+            # 8x8 leaf, rows end in $ and trailing dead cells and rows are left out
+            cells = []
+            for y, row in enumerate(line.split("$")):
+                cells.extend((x, y) for x, char in enumerate(row) if char == "*")
+            nodes.append(node_cls.from_cells(cells, level=3))
+            continue
+        try:
+            level, *children = (int(field) for field in line.split())
+        except ValueError:
+            raise ValueError("malformed Macrocell: {!r}".format(line)) from None
+        if len(children) != 4 or level < 4 or max(children) >= len(nodes):
+            raise ValueError("malformed Macrocell: {!r}".format(line))
+        empty = node_cls.empty(level - 1)
+        nodes.append(node_cls(*(nodes[child] if child else empty for child in children)))
+    if len(nodes) == 1:
+        raise ValueError("malformed Macrocell: no nodes")
+    return nodes[-1]
+
+
+def _leaf_line(node):
+    """Macrocell line of a level 3 node, rows end in $ and trailing dead cells are left out"""
+    rows = [[] for _ in range(8)]
+    for x, y in node.iter_live_cells():
+        rows[y].append(x)
+    while len(rows) > 1 and not rows[-1]:
+        rows.pop()
+    return "".join(
+        "".join("*" if x in xs else "." for x in range(max(xs, default=-1) + 1)) + "$"
+        for xs in rows
+    )
+
+
+def write_macrocell(node, fileobj, node_cls=None):
+    """Write node as a Golly Macrocell file, one line per distinct non-empty subtree
+
+    Nodes below level 3, Macrocell's leaf size, are expanded to level 3. The #R line names the
+    rule of node_cls, the class of node by default, as in write_rle. Only two-state rules are
+    supported.
+    """
+    node_cls = node_cls or type(node)
+    if issubclass(node_cls, MultiStateNode):
+        raise ValueError("Macrocell files are only written for two-state rules")
+    while node.level < 3:
+        node = node.expand()
+    fileobj.write("[M2] (hashlife)\n")
+    fileobj.write("#R {}\n".format(node_cls.rule_string()))
+    # empty subtrees are written as id 0, except for an empty root
+    ids = {}
+    written = 0
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in ids:
+            stack.pop()
+            continue
+        if current is not node and current is node.empty(current.level):
+            ids[current] = 0
+            stack.pop()
+            continue
+        if current.level == 3:
+            fileobj.write(_leaf_line(current) + "\n")
+        else:
+            children = (current.nw, current.ne, current.sw, current.se)
+            missing = [child for child in children if child not in ids]
+            if missing:
+                stack.extend(missing)
+                continue
+            fileobj.write(
+                "{} {} {} {} {}\n".format(current.level, *(ids[child] for child in children))
+            )
+        stack.pop()
+        written += 1
+        ids[current] = written
+
+
+SNAPSHOT_MAGIC = b"HLSNAP02"
+# magic, birth mask, survive mask, node count, root count
+_SNAPSHOT_HEADER = struct.Struct("<8sHHII")
+# level, nw, ne, sw, se, next_gen, leap_gen
+_SNAPSHOT_RECORD = struct.Struct("<7I")
+# nw, ne, sw, se of a record
+_SNAPSHOT_CHILDREN = struct.Struct("<4x4I")
+_SNAPSHOT_ID = struct.Struct("<I")
+_CHILDREN = operator.attrgetter("nw", "ne", "sw", "se")
+
+
+def _rule_masks(node_cls):
+    if issubclass(node_cls, MultiStateNode):
+        raise ValueError("Snapshots only support two-state rules")
+    return (
+        sum(1 << alive for alive in node_cls.RULE_BIRTH),
+        sum(1 << alive for alive in node_cls.RULE_SURVIVE),
+    )
+
+
+def save_snapshot(path, roots, node_cls=Node):
+    """Write every node in node_cls.ALL_NODES and its next_gen/leap_gen memos to path
+
+    Nodes are written lowest level first, so children and memoized results always come
+    before the nodes referring to them. Ids 0 and 1 are State.DEAD and State.ALIVE, nodes
+    are numbered from 2 in file order and a memo id of 0 means no memo. The records are
+    followed by an index of the node ids sorted by their children's ids, and the ids of roots
+    are kept for load_snapshot(). Memos of other step sizes are not saved.
+    """
+    masks = _rule_masks(node_cls)
+    by_level = {}
+    for node in node_cls.ALL_NODES.values():
+        by_level.setdefault(node.level, []).append(node)
+    ordered = [node for level in sorted(by_level) for node in by_level[level]]
+    ids = {State.DEAD: 0, State.ALIVE: 1}
+    ids.update((node, index + 2) for index, node in enumerate(ordered))
+    roots = list(roots)
+    with open(path, "wb") as fileobj:
+        fileobj.write(
+            _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, *masks, len(ordered), len(roots))
+        )
+        fileobj.write(struct.pack("<{}I".format(len(roots)), *(ids[root] for root in roots)))
+        for node in ordered:
+            fileobj.write(
+                _SNAPSHOT_RECORD.pack(
+                    node.level, ids[node.nw], ids[node.ne], ids[node.sw], ids[node.se],
+                    ids.get(node_cls._get_memo(node, 0), 0),
+                    ids.get(node_cls._get_memo(node, node.level - 2), 0)
+                )
+            )
+        keys = [tuple(ids[child] for child in _CHILDREN(node)) for node in ordered]
+        order = sorted(range(len(ordered)), key=keys.__getitem__)
+        fileobj.write(struct.pack("<{}I".format(len(order)), *(index + 2 for index in order)))
+
+
+class _SnapshotIndex:
+    """Memoized results of a memory-mapped snapshot, read the first time they are needed
+
+    A node is looked up by its children's ids, which are looked up the same way, in the
+    snapshot's sorted index. The ids and nodes found are cached until the node store is next
+    collected.
+    """
+
+    def __init__(self, buf, node_cls, count, offset):
+        self.buf = buf
+        self.node_cls = node_cls
+        self.count = count
+        # the record of node_id is at offset + node_id * record size
+        self.offset = offset
+        self.index = offset + (count + 2) * _SNAPSHOT_RECORD.size
+        self.epoch = None
+
+    def _record(self, node_id):
+        return _SNAPSHOT_RECORD.unpack_from(self.buf, self.offset + node_id * _SNAPSHOT_RECORD.size)
+
+    def _find(self, children):
+        """Id of the record with these child ids, or None"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            node_id, = _SNAPSHOT_ID.unpack_from(self.buf, self.index + 4 * middle)
+            found = _SNAPSHOT_CHILDREN.unpack_from(
+                self.buf, self.offset + node_id * _SNAPSHOT_RECORD.size
+            )
+            if found < children:
+                low = middle + 1
+            elif found > children:
+                high = middle
             else:
-                char_list.append(dead_char)
-    return "".join(char_list)
\ No newline at end of file
+                return node_id
+        return None
+
+    def _check_epoch(self):
+        # collecting can drop cached nodes from the store, so they are no longer canonical
+        if self.epoch != self.node_cls.epoch:
+            self.epoch = self.node_cls.epoch
+            self.ids = {State.DEAD: 0, State.ALIVE: 1}
+            self.nodes = {0: State.DEAD, 1: State.ALIVE}
+
+    def node_id(self, node):
+        """Id of node in the snapshot, or None if it is not in it"""
+        self._check_epoch()
+        ids = self.ids
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if current in ids:
+                stack.pop()
+                continue
+            children = _CHILDREN(current)
+            missing = [child for child in children if child not in ids]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            children = tuple(ids[child] for child in children)
+            ids[current] = None if None in children else self._find(children)
+        return ids[node]
+
+    def node(self, node_id):
+        """Canonical node of a record, building the records below it as needed"""
+        self._check_epoch()
+        nodes = self.nodes
+        stack = [node_id]
+        while stack:
+            current = stack[-1]
+            if current in nodes:
+                stack.pop()
+                continue
+            children = self._record(current)[1:5]
+            missing = [child for child in children if child not in nodes]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            node = self.node_cls(*(nodes[child] for child in children))
+            nodes[current] = node
+            self.ids[node] = current
+        return nodes[node_id]
+
+    def memo(self, node, power):
+        """Memoized result of node 2 ** power generations ahead, or None"""
+        if power != 0 and power != node.level - 2:
+            return None
+        node_id = self.node_id(node)
+        if node_id is None:
+            return None
+        memo_id = self._record(node_id)[5 if power == 0 else 6]
+        return self.node(memo_id) if memo_id else None
+
+
+def load_snapshot(path, node_cls=Node):
+    """Restore the roots written by save_snapshot() and attach the rest as node_cls.SNAPSHOT
+
+    Only the roots are built up front. The file stays memory-mapped while attached, and a
+    memoized result missing during evaluation is looked up in it and loaded with its subtree,
+    so the cost scales with the nodes actually touched. Set node_cls.SNAPSHOT to None to stop
+    looking up results in it. Raises ValueError if the snapshot was taken with different
+    rules.
+    """
+    with open(path, "rb") as fileobj:
+        buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buf) < _SNAPSHOT_HEADER.size:
+        buf.close()
+        raise ValueError("malformed snapshot")
+    magic, birth, survive, count, root_count = _SNAPSHOT_HEADER.unpack_from(buf)
+    if magic != SNAPSHOT_MAGIC:
+        buf.close()
+        raise ValueError("malformed snapshot")
+    if (birth, survive) != _rule_masks(node_cls):
+        buf.close()
+        raise ValueError("snapshot rules differ from the current rules")
+    root_ids = struct.unpack_from("<{}I".format(root_count), buf, _SNAPSHOT_HEADER.size)
+    # node ids start at 2
+    offset = _SNAPSHOT_HEADER.size + 4 * root_count - 2 * _SNAPSHOT_RECORD.size
+    snapshot = _SnapshotIndex(buf, node_cls, count, offset)
+    node_cls.SNAPSHOT = snapshot
+    return [snapshot.node(node_id) for node_id in root_ids]
@@ -0,0 +1,99 @@
+"""Process pool evaluation of leap_gen for patterns with little reuse"""
+
+import concurrent.futures
+
+from hashlife.core import Universe
+
+# universe per rule in a worker process
+_UNIVERSES = {}
+
+
+def _leap_worker(rule, table):
+    """Leap a flattened node in a worker process
+
+    Each worker keeps a universe per rule whose ALL_NODES acts as a partial node store that
+    persists between tasks.
+    """
+    universe = _UNIVERSES.get(rule, None)
+    if universe is None:
+        universe = _UNIVERSES[rule] = Universe(rule)
+    return universe.node_cls.unflatten(table).leap_gen().flatten()
+
+
+def _gather(tasks):
+    """Run task generators side by side, merging the batches they yield into one"""
+    results = [None] * len(tasks)
+    pending = {}
+    for index, task in enumerate(tasks):
+        try:
+            pending[index] = next(task)
+        except StopIteration as stop:
+            results[index] = stop.value
+    while pending:
+        leaped = yield [node for batch in pending.values() for node in batch]
+        start = 0
+        still_pending = {}
+        for index, batch in pending.items():
+            try:
+                still_pending[index] = tasks[index].send(leaped[start:start + len(batch)])
+            except StopIteration as stop:
+                results[index] = stop.value
+            start += len(batch)
+        pending = still_pending
+    return results
+
+
+def _leap_tasks(node, depth, cls):
+    """Generator computing node.leap_gen() that yields the nodes depth levels down to leap
+
+    The leaps of each yielded list of nodes must be sent back in the same order.
+    """
+    memo = cls._get_memo(node, node.level - 2)
+    if memo is not None:
+        return memo
+    if depth == 0 or node.level <= 3:
+        leaped = yield [node]
+        return leaped[0]
+    n00, n01, n02, n10, n11, n12, n20, n21, n22 = yield from _gather(
+        [_leap_tasks(subnode, depth - 1, cls) for subnode in node._nine_subnodes()]
+    )
+    quadrants = yield from _gather([
+        _leap_tasks(cls(n00, n01, n10, n11), depth - 1, cls),
+        _leap_tasks(cls(n01, n02, n11, n12), depth - 1, cls),
+        _leap_tasks(cls(n10, n11, n20, n21), depth - 1, cls),
+        _leap_tasks(cls(n11, n12, n21, n22), depth - 1, cls),
+    ])
+    return cls._set_memo(node, node.level - 2, cls(*quadrants))
+
+
+def parallel_leap_gen(node, depth=1, processes=None, executor=None, node_cls=None):
+    """Return node.leap_gen(), leaping the subtrees depth levels down in a process pool
+
+    The top depth levels are evaluated here, and all subtrees that can be leaped at the same
+    time are handed to the pool together, up to 9 ** depth at once. Results are merged back
+    into the canonical ALL_NODES by content and memoized like serial results. An existing
+    concurrent.futures executor can be passed in to avoid starting new processes every call.
+    node_cls is the class whose rule and memos are used, node's own class by default.
+    """
+    if node.level == 1:
+        raise ValueError("Cannot call leap_gen() on a level 1 node")
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            return parallel_leap_gen(node, depth, executor=executor, node_cls=node_cls)
+    cls = node.__class__ if node_cls is None else node_cls
+    tasks = _leap_tasks(node, depth, cls)
+    try:
+        batch = next(tasks)
+        while True:
+            unique = list(dict.fromkeys(batch))
+            rule = cls.rule_string()
+            tables = executor.map(
+                _leap_worker, [rule] * len(unique), [subnode.flatten() for subnode in unique]
+            )
+            leaped = {
+                subnode: cls._set_memo(subnode, subnode.level - 2, cls.unflatten(table))
+                for subnode, table in zip(unique, tables)
+            }
+            batch = tasks.send([leaped[subnode] for subnode in batch])
+    except StopIteration as stop:
+        return stop.value
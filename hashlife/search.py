@@ -0,0 +1,155 @@
+"""Helpers for running and classifying many patterns"""
+
+import collections
+
+from hashlife.core import Universe, advance
+
+Period = collections.namedtuple("Period", ("period", "displacement", "generation"))
+
+
+def _normalized(node):
+    """Return the canonical node of node's cells moved to (0, 0), and where they were
+
+    The position is the nw corner of the live cells' bounding box relative to node's center,
+    which advance() keeps fixed.
+    """
+    cells = list(node.iter_cells())
+    if not cells:
+        return node.empty(1), (0, 0)
+    min_x = min(x for x, _, _ in cells)
+    min_y = min(y for _, y, _ in cells)
+    half = 2**(node.level - 1)
+    shifted = node.__class__.from_cells({(x - min_x, y - min_y): state for x, y, state in cells})
+    return shifted, (min_x - half, min_y - half)
+
+
+def _prime_factors(number):
+    factors = []
+    factor = 2
+    while factor * factor <= number:
+        if number % factor == 0:
+            factors.append(factor)
+            while number % factor == 0:
+                number //= factor
+        factor += 1
+    if number > 1:
+        factors.append(number)
+    return factors
+
+
+def detect_period(node, max_gen, node_cls=None):
+    """Find the period and displacement node settles into within max_gen generations
+
+    Returns a Period with the period in generations, the (dx, dy) the pattern moves every
+    period and a generation at which it is already periodic, or None if no repeat was found.
+    Still lifes have period 1 and spaceships a nonzero displacement. A pattern that dies out
+    becomes the empty still life.
+
+    The pattern is sampled every chunk generations and each sample, modulo translation, is
+    looked up among all earlier samples; since patterns are canonical nodes, that is a dict
+    lookup on the normalized node. The chunk doubles after every other stretch of samples,
+    and each stretch is twice as long as the last, so the number of advance() calls grows
+    with the square root of the generations. A pattern is only normalized when its cached
+    population matches an earlier sample's. Once the pattern has settled, a period p is found
+    within about p plus one chunk generations, and the last chunk is cut short at max_gen. A
+    repeat after some number of generations means the period divides it, and the period is
+    then narrowed down by advancing the earlier sample by each candidate divisor. node_cls is
+    the class whose rule is used, node's own class by default.
+    """
+    # normalized shape to (generation, position, node) of an earlier sample
+    samples = {}
+    # the first sample of each population, normalized once another sample has that population
+    firsts = {node.population: (0, node)}
+    # samples are compared by identity, so they stay canonical through collections
+    roots = [node]
+    generation = 0
+    stretch = 0
+    while True:
+        chunk = 2**(stretch // 2)
+        for _ in range(2**(stretch - stretch // 2)):
+            step = min(chunk, max_gen - generation)
+            if step <= 0:
+                return None
+            node = advance(node, step, node_cls=node_cls, roots=roots)
+            generation += step
+            roots.append(node)
+            population = node.population
+            if population not in firsts:
+                firsts[population] = (generation, node)
+                continue
+            if firsts[population] is not None:
+                first_gen, first = firsts[population]
+                first_shape, first_position = _normalized(first)
+                samples[first_shape] = (first_gen, first_position, first)
+                roots.append(first_shape)
+                firsts[population] = None
+            shape, position = _normalized(node)
+            sample = samples.get(shape, None)
+            if sample is not None:
+                sample_gen, sample_position, sample_node = sample
+                return _narrow_period(
+                    sample_node, sample_position, sample_gen, generation - sample_gen, position,
+                    node_cls, roots
+                )
+            samples[shape] = (generation, position, node)
+            roots.append(shape)
+        stretch += 1
+
+
+def _narrow_period(node, position, generation, repeat, repeat_position, node_cls, roots):
+    """Period of node given that its shape repeats after repeat generations, at repeat_position
+
+    Every prime factor is divided out of repeat for as long as the shape still repeats after
+    the shorter number of generations. roots are kept canonical along with node and its shape.
+    """
+    shape = _normalized(node)[0]
+    period = repeat
+    for factor in _prime_factors(repeat):
+        while period % factor == 0:
+            candidate = advance(node, period // factor, node_cls=node_cls, roots=roots)
+            if candidate.population != node.population:
+                break
+            candidate_shape, candidate_position = _normalized(candidate)
+            if candidate_shape is not shape:
+                break
+            period //= factor
+            repeat_position = candidate_position
+    displacement = (repeat_position[0] - position[0], repeat_position[1] - position[1])
+    return Period(period, displacement, generation)
+
+
+def run_batch(patterns, generations, batch_size=100, max_nodes=None, keep_level=4, node_cls=None):
+    """Advance every pattern by generations in one shared node store, yielding the results
+
+    patterns is an iterable of live cell iterables as taken by Node.from_cells(), and results
+    are yielded in order as soon as each is computed. Sub-patterns common to many patterns,
+    such as blocks, blinkers and gliders, are canonicalized and memoized once for all of them.
+
+    After every batch_size patterns, if the store holds more than max_nodes nodes
+    (node_cls.MAX_NODES if None, always if both are None), it is collected down to the nodes
+    of level keep_level and below that were used within the last node_cls.MEMO_MAX_AGE
+    collections, along with their memoized results. Small common sub-patterns thus carry over
+    to the next batch while the rest of the store is freed. If that is still over max_nodes,
+    the kept level is lowered until it fits. Nodes yielded before a collection are no longer
+    canonical after it, keep their population, fingerprint or cells instead.
+
+    The store is node_cls, a fresh Life universe's by default, so collecting it never frees
+    nodes held by other callers of the process-wide Node store.
+    """
+    if node_cls is None:
+        node_cls = Universe().node_cls
+    if max_nodes is None:
+        max_nodes = node_cls.MAX_NODES
+    for index, cells in enumerate(patterns, 1):
+        yield advance(node_cls.from_cells(cells), generations, node_cls=node_cls)
+        if index % batch_size or max_nodes is not None and len(node_cls.ALL_NODES) <= max_nodes:
+            continue
+        recent = [
+            node for node in node_cls.ALL_NODES.values()
+            if node.level <= keep_level and node_cls.epoch - node._stamp <= node_cls.MEMO_MAX_AGE
+        ]
+        for level in range(keep_level, -1, -1):
+            # only small nodes are left, so their memos can all be kept
+            node_cls.collect([node for node in recent if node.level <= level])
+            if max_nodes is None or len(node_cls.ALL_NODES) <= max_nodes:
+                break
@@ -0,0 +1,88 @@
+"""Tests for aio module"""
+
+import asyncio
+
+import pytest
+
+from hashlife.aio import leap_gen_async, next_gen_async, step_gen_async
+from hashlife.core import Node
+
+from tests.helpers import random_cells
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    try:
+        yield loop
+    finally:
+        loop.close()
+
+
+def expected(node, power):
+    result = node.step_gen(power)
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    return set(result.iter_live_cells())
+
+
+def test_iter_step_gen_progress():
+    node = Node.from_cells(random_cells(32, 0), level=6).expand()
+    updates = list(node.iter_step_gen(3, chunk_size=10))
+    assert len(updates) > 2
+    assert all(update.result is None for update in updates[:-1])
+    assert updates[-1].pending == 0
+    assert updates[-1].result is node.step_gen(3)
+    frames = [update.frames for update in updates]
+    assert frames == sorted(frames)
+
+
+def test_iter_step_gen_bad_arguments():
+    node = Node.from_cells(random_cells(8, 0), level=6).expand()
+    with pytest.raises(ValueError):
+        node.iter_step_gen(node.level - 1)
+    with pytest.raises(ValueError):
+        node.iter_step_gen(0, chunk_size=0)
+
+
+@pytest.mark.parametrize("power", [0, 2, 5])
+def test_step_gen_async(loop, power):
+    node = Node.from_cells(random_cells(32, power), level=6).expand()
+    cells = expected(node, power)
+    node = Node.from_cells(random_cells(32, power), level=6).expand()
+    updates = []
+    result = loop.run_until_complete(step_gen_async(node, power, 50, updates.append))
+    assert set(result.iter_live_cells()) == cells
+    assert updates[-1].result is result
+
+
+def test_next_and_leap_gen_async(loop):
+    node = Node.from_cells(random_cells(16, 1), level=6).expand()
+    assert loop.run_until_complete(next_gen_async(node)) is node.next_gen()
+    assert loop.run_until_complete(leap_gen_async(node)) is node.leap_gen()
+    with pytest.raises(ValueError):
+        loop.run_until_complete(next_gen_async(Node.empty(1)))
+
+
+def test_cancel_keeps_memos(loop):
+    node = Node.from_cells(random_cells(32, 2), level=6).expand()
+    cells = expected(node, node.level - 2)
+    node = Node.from_cells(random_cells(32, 2), level=6).expand()
+    updates = []
+
+    def cancel_after_three(update):
+        updates.append(update)
+        if len(updates) == 3:
+            task.cancel()
+
+    task = loop.create_task(leap_gen_async(node, 20, cancel_after_three))
+    with pytest.raises(asyncio.CancelledError):
+        loop.run_until_complete(task)
+    assert len(updates) == 3
+    assert updates[-1].result is None
+    memoized = [
+        memo for memo in Node.ALL_NODES.values()
+        if memo._next_gen is not None or memo._leap_gen is not None
+    ]
+    assert memoized
+    assert set(node.leap_gen().iter_live_cells()) == cells
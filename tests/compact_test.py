@@ -0,0 +1,90 @@
+"""Tests for compact module"""
+
+import tracemalloc
+
+import pytest
+
+from hashlife.compact import CompactNode, CompactStore
+from hashlife.core import Node, State, Universe
+from hashlife.io import state_map_to_str, str_to_state_map
+
+from tests.helpers import random_cells
+
+GLIDER = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+
+
+def test_canonical_ids():
+    store = CompactStore()
+    node = store.from_cells(GLIDER, level=4)
+    assert store.from_cells(GLIDER, level=4) == node
+    assert store.from_cells(GLIDER, level=4).id == node.id
+    assert store.from_cells(GLIDER - {(1, 0)}, level=4) != node
+    assert node.level == 4
+    assert node.population == 5
+    assert node.se.se.se == store.empty(1)
+    assert node.nw.nw.nw.ne is State.ALIVE
+    assert len({node, store.from_cells(GLIDER, level=4)}) == 1
+    assert CompactStore().from_cells(GLIDER, level=4) != node
+    with pytest.raises(RuntimeError):
+        bool(node)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_matches_node(seed):
+    cells = random_cells(32, seed)
+    store = CompactStore()
+    node, compact = Node.from_cells(cells, level=6), store.from_cells(cells, level=6)
+    assert compact.flatten() == node.flatten()
+    assert compact.leap_gen().flatten() == node.leap_gen().flatten()
+    assert compact.next_gen().flatten() == node.next_gen().flatten()
+    assert compact.step_gen(2).flatten() == node.step_gen(2).flatten()
+    assert compact.expand().flatten() == node.expand().flatten()
+    assert compact.expand().shrink() == compact
+    assert set(compact.iter_live_cells()) == cells
+    assert compact.population == node.population
+
+
+def test_convert():
+    store = CompactStore("B36/S23")
+    highlife = Universe("B36/S23")
+    node = highlife.from_cells(random_cells(32, 3), level=6)
+    compact = store.adopt(node)
+    assert store.adopt(compact) is compact
+    assert highlife.node_cls.unflatten(compact.leap_gen().flatten()) is node.leap_gen()
+    assert store.unflatten(node.flatten()) == compact
+    with pytest.raises(ValueError):
+        store.adopt(Universe("WireWorld").from_cells({(0, 0): 3}))
+    with pytest.raises(ValueError):
+        CompactStore("B2/S/C3")
+
+
+def test_state_map_round_trip():
+    strmap = "0110" "1100" "0100" "0000"
+    compact = CompactStore().from_state_map(str_to_state_map(strmap))
+    assert isinstance(compact, CompactNode)
+    assert state_map_to_str(compact.as_state_map()) == strmap
+    assert compact.flatten() == Node.from_state_map(str_to_state_map(strmap)).flatten()
+    with pytest.raises(ValueError):
+        compact.shrink()
+
+
+def test_bytes_per_node():
+    cells = random_cells(64, 0)
+    # the leaf tables are shared setup, not per node
+    Node._leaf_table()  # pylint: disable=protected-access
+    store = CompactStore()
+    tracemalloc.start()
+    try:
+        Node.from_cells(cells).leap_gen()
+        node_bytes = tracemalloc.get_traced_memory()[0] / len(Node.ALL_NODES)
+    finally:
+        tracemalloc.stop()
+    tracemalloc.start()
+    try:
+        store.from_cells(cells).leap_gen()
+        compact_bytes = tracemalloc.get_traced_memory()[0] / len(store)
+    finally:
+        tracemalloc.stop()
+    assert len(store) == len(Node.ALL_NODES)
+    assert store.nbytes / len(store) < 48
+    assert node_bytes / compact_bytes >= 5
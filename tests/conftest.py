@@ -0,0 +1,26 @@
+"""Shared fixtures for the tests"""
+
+import pytest
+
+from hashlife.core import Node
+
+RULE_BIRTH = Node.RULE_BIRTH
+RULE_SURVIVE = Node.RULE_SURVIVE
+
+
+@pytest.fixture(autouse=True)
+def clear_all_nodes():
+    try:
+        yield
+    finally:
+        Node.ALL_NODES = {}
+        Node.ALL_EMPTY = {}
+        Node.RULE_BIRTH = RULE_BIRTH
+        Node.RULE_SURVIVE = RULE_SURVIVE
+        Node.MAX_NODES = None
+        Node.STATS = None
+        Node.TRACE = None
+        Node.DENSE_LEVEL = None
+        Node.DENSE_HIT_RATE = None
+        Node.SNAPSHOT = None
+
@@ -1,10 +1,19 @@
 """Tests for core module"""
 
+import io
+import random
+import re
+
 import pytest
 
-from hashlife.core import State, StateMap, Node
+from hashlife.core import (
+    CELLS, Cell, State, StateMap, Node, Stats, Topology, Trace, Universe, WIREWORLD_TRANSITIONS,
+    advance, format_rule, generations_transitions, parse_generations_rule, parse_rule
+)
 from hashlife.io import str_to_state_map, state_map_to_str
 
+from tests.helpers import random_cells
+
 
 def test_state():
     assert bool(State.ALIVE)
@@ -23,14 +32,69 @@ def test_map_2x2():
     assert m.se.val == State.DEAD
 
 
-class TestNode:
+def test_map_views():
+    rows = [[State(bool((x * y) % 3)) for x in range(4)] for y in range(4)]
+    m = StateMap(2, rows)
+    assert m.rows == rows
+    assert m.se.cells is m.cells
+    assert (m.se.row, m.se.col, m.se.row_slice) == (2, 2, slice(2, 4))
+    assert m.se.nw.val is rows[2][2]
+    assert m.ne.val == [row[2:] for row in rows[:2]]
+    assert m.sw.flat() == rows[2][:2] + rows[3][:2]
+    view = StateMap(1, rows, row_slice=slice(2, 4), col_slice=slice(0, 2))
+    assert view.rows == m.sw.rows
+    assert StateMap.from_buffer(2, m.cells).rows == rows
+
+
+def live_cells(node):
+    """Live cells of node relative to its center"""
+    half = 2**(node.level - 1)
+    return {(x - half, y - half) for x, y in node.iter_live_cells()}
+
+
+def life_step(cells):
+    """Reference B3/S23 step on a set of live cells"""
+    counts = {}
+    for x, y in cells:
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if dx or dy:
+                    counts[(x + dx, y + dy)] = counts.get((x + dx, y + dy), 0) + 1
+    return {cell for cell, count in counts.items() if count == 3 or count == 2 and cell in cells}
+
+
+def life_step_torus(cells, size):
+    """Reference B3/S23 step on a size x size torus"""
+    tiled = {
+        (x + dx, y + dy) for x, y in cells for dx in (-size, 0, size) for dy in (-size, 0, size)
+    }
+    return {(x, y) for x, y in life_step(tiled) if 0 <= x < size and 0 <= y < size}
+
+
+def multistate_step(cells, transitions):
+    """Reference step of a multi-state rule on a dict of non-dead cells"""
+    counts = {}
+    for (x, y), state in cells.items():
+        if state == 1:
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    if dx or dy:
+                        counts[(x + dx, y + dy)] = counts.get((x + dx, y + dy), 0) + 1
+    result = {}
+    for cell in set(cells) | set(counts):
+        state = transitions[cells.get(cell, 0)][counts.get(cell, 0)]
+        if state:
+            result[cell] = state
+    return result
+
 
-    @pytest.fixture(autouse=True)
-    def clear_all_nodes(self):
-        try:
-            yield
-        finally:
-            Node.ALL_NODES = {}
+def multistate_cells(node):
+    """Non-dead cells of node by position relative to its center"""
+    half = 2**(node.level - 1)
+    return {(x - half, y - half): state for x, y, state in node.iter_cells()}
+
+
+class TestNode:
 
     @pytest.mark.parametrize("onehot", range(4))
     def test_new_2x2_onehot(self, onehot):
@@ -122,6 +186,18 @@ class TestNode:
         state_map = n.as_state_map(state_map)
         assert state_map.rows == [[states[0], states[1]], [states[2], states[3]]]
 
+    def test_state_map_quadrants(self):
+        node = Node.from_cells({(0, 0), (1, 2), (3, 3)}, level=2)
+        state_map = Node.empty(3).as_state_map()
+        assert node.as_state_map(state_map.se) is not None
+        assert Node.from_state_map(state_map.se) is node
+        assert Node.from_state_map(state_map) is Node(
+            Node.empty(2), Node.empty(2), Node.empty(2), node
+        )
+        assert state_map.nw.flat() == [State.DEAD] * 16
+        with pytest.raises(ValueError):
+            node.as_state_map(state_map)
+
     def test_as_state_map_4x4(self):
         states = (State.DEAD, State.ALIVE, State.ALIVE, State.DEAD)
         n1 = Node(*states)
@@ -249,3 +325,470 @@ class TestNode:
             "0110"
         )
         assert node._leap_gen is n_next
+
+    @pytest.mark.parametrize("cells", range(0, 1 << 16, 4099))
+    def test_leaf_table_matches_rule(self, cells):
+        strmap = "".join(str(cells >> bit & 1) for bit in range(16))
+        node = Node.from_state_map(str_to_state_map(strmap))
+        alive = tuple(node._neighbors_alive())
+        centers = (node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+        n_next = node.next_gen()
+        assert (n_next.nw, n_next.ne, n_next.sw, n_next.se) == tuple(
+            State(Node._eval_rule(cell, count)) for cell, count in zip(centers, alive)
+        )
+
+    def test_leaf_table_rule_change(self):
+        node = Node.from_state_map(str_to_state_map("0000" "0100" "0000" "0000"))
+        assert node.next_gen() is Node.empty(1)
+        Node.RULE_BIRTH = frozenset((1,))
+        node = Node.from_state_map(str_to_state_map("0000" "0000" "0010" "0000"))
+        n_next = node.next_gen()
+        assert (n_next.nw, n_next.ne, n_next.sw, n_next.se) == (
+            State.ALIVE, State.ALIVE, State.ALIVE, State.DEAD
+        )
+
+    def test_stats(self):
+        exported = []
+        Node.STATS = Stats(hook=lambda stats: exported.append(stats.as_dict()))
+        node = Node.from_state_map(str_to_state_map("0100" "0010" "1110" "0000"))
+        assert Node.STATS.created[1] == 4
+        assert Node.STATS.canonical_hits[1] == 0
+        node = node.expand().expand()
+        n_leap = node.leap_gen()
+        assert len(exported) == 1
+        assert exported[0]["memo_misses"][4] == 1
+        assert exported[0]["memo_misses"][2] > 0
+        assert Node.STATS.memo_hits[2] > 0
+        assert set(Node.STATS.seconds) == {2, 3, 4}
+        assert sum(Node.STATS.created.values()) == len(Node.ALL_NODES)
+        assert node.leap_gen() is n_leap
+        assert len(exported) == 2
+        assert exported[1]["memo_hits"][4] == 1
+        assert Node.STATS.memo_hit_rate(4) == 0.5
+        assert Node.STATS.memo_hit_rate(9) is None
+        Node.STATS.reset()
+        assert not Node.STATS.created
+
+    @pytest.mark.parametrize("chunk_size", [None, 7])
+    def test_trace(self, chunk_size):
+        cells = random_cells(32, 0)
+        node = Node.from_cells(cells, level=5)
+        Node.STATS = Stats()
+        Node.TRACE = Trace()
+        if chunk_size is None:
+            node.leap_gen()
+        else:
+            list(node.iter_step_gen(3, chunk_size))
+        trace = Node.TRACE
+        assert sum(trace.misses.values()) == sum(Node.STATS.memo_misses.values())
+        assert trace.misses[((5, 0, 0),)] == 1
+        children = {stack[1] for stack in trace.misses if len(stack) == 2}
+        # the nine overlapping subnodes and the four quadrants of their results
+        assert children == {(4, x, y) for x in (0, 8, 16) for y in (0, 8, 16)} | {
+            (4, x, y) for x in (4, 12) for y in (4, 12)
+        }
+        assert all(stack[-1][0] == 2 for stack in trace.misses if len(stack) == 4)
+        assert all(
+            0 <= x and x + 2**level <= 32 for stack in trace.seconds for level, x, _ in stack
+        )
+        heatmap = trace.heatmap()
+        # one row per evaluated extent, the top level node only for its own self time
+        assert (0, 0, 32) in heatmap
+        assert {size for _, _, size in heatmap} <= {4, 8, 16, 32}
+        assert all(x % (size // 4) == 0 and y % (size // 4) == 0 for x, y, size in heatmap)
+        assert sum(misses for _, misses in heatmap.values()) == sum(trace.misses.values())
+        assert sum(seconds for seconds, _ in heatmap.values()) == pytest.approx(
+            sum(trace.seconds.values())
+        )
+        collapsed = io.StringIO()
+        trace.write_collapsed(collapsed)
+        lines = collapsed.getvalue().splitlines()
+        assert len(lines) == len(trace.seconds)
+        assert all(re.fullmatch(r"L5@0,0(;L\d@\d+,\d+)* \d+", line) for line in lines)
+        csv = io.StringIO()
+        trace.write_heatmap(csv)
+        assert csv.getvalue().splitlines()[0] == "x,y,size,seconds,misses"
+        assert len(csv.getvalue().splitlines()) == len(heatmap) + 1
+        trace.reset()
+        assert not trace.seconds
+
+    def test_collect_unreachable(self):
+        keep = Node.from_state_map(str_to_state_map("0110" "1001" "0110" "0000"))
+        Node.from_state_map(str_to_state_map("1111" "0000" "0000" "1111"))
+        stats = Node.collect([keep])
+        assert stats.collected > 0
+        assert stats.kept == len(Node.ALL_NODES)
+        assert Node(keep.nw, keep.ne, keep.sw, keep.se) is keep
+        assert Node.empty(1) in Node.ALL_NODES.values()
+        assert Node.last_collect is stats
+
+    def test_collect_memo_age(self):
+        strmap = (  # yapf: disable
+            "00000000"
+            "00000000"
+            "00010000"
+            "00001000"
+            "00111000"
+            "00000000"
+            "00000000"
+            "00000000"
+        )
+        node = Node.from_state_map(str_to_state_map(strmap))
+        n_leap = node.leap_gen()
+        Node.collect([node], max_memo_age=None)
+        assert node._leap_gen is n_leap
+        assert node.leap_gen() is n_leap
+        Node.collect([node], max_memo_age=0)
+        assert node._leap_gen is n_leap
+        Node.collect([node], max_memo_age=0)
+        assert node._leap_gen is None
+        assert n_leap not in Node.ALL_NODES.values()
+
+    def test_maybe_collect(self):
+        node = Node.from_state_map(str_to_state_map("0110" "1001" "0110" "0000"))
+        assert Node.maybe_collect([node]) is None
+        Node.from_state_map(str_to_state_map("1111" "0000" "0000" "1111"))
+        Node.MAX_NODES = 5
+        stats = Node.maybe_collect([node])
+        assert stats.collected > 0
+        assert Node.maybe_collect([node]) is None
+
+    def test_next_gen_deep(self):
+        node = Node.from_state_map(str_to_state_map("0100" "0010" "1110" "0000"))
+        expected = life_step(live_cells(node))
+        # deeper than the default recursion limit
+        for _ in range(1100):
+            node = node.expand()
+        assert live_cells(node.next_gen()) == expected
+
+    def test_from_cells(self):
+        strmap = "0000" "0010" "0001" "0111"
+        node = Node.from_cells([(2, 1), (3, 2), (1, 3), (2, 3), (3, 3)])
+        assert node is Node.from_state_map(str_to_state_map(strmap))
+        assert Node.from_cells([(0, 0)], level=3).level == 3
+        assert Node.from_cells([]) is Node.empty(1)
+        with pytest.raises(ValueError):
+            Node.from_cells([(-1, 0)])
+        with pytest.raises(ValueError):
+            Node.from_cells([(4, 0)], level=2)
+
+    def test_iter_live_cells_sparse(self):
+        cells = {(0, 0), (2**40 - 1, 2**40 - 1), (12345, 2**39 + 7)}
+        node = Node.from_cells(cells)
+        assert node.level == 40
+        assert set(node.iter_live_cells()) == cells
+        assert list(Node.empty(40).iter_live_cells()) == []
+
+    def test_population(self):
+        assert State.ALIVE.population == 1
+        assert State.DEAD.population == 0
+        cells = {(0, 0), (3, 1), (200, 7), (9, 255)}
+        node = Node.from_cells(cells, level=8)
+        assert node.population == 4
+        assert node.nw.population == 2
+        assert node.expand().population == 4
+        assert Node.empty(30).population == 0
+
+    def test_fingerprint(self):
+        glider = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+        node = Node.from_cells(glider)
+        # stable across processes and runs
+        assert node.fingerprint == 0xf74ec5007d28fe6e
+        assert Universe("B36/S23").from_cells(glider).fingerprint == node.fingerprint
+        assert Node.from_cells(glider, level=3).fingerprint != node.fingerprint
+        assert Node.from_cells(glider - {(1, 0)}).fingerprint != node.fingerprint
+        fingerprints = {
+            Node.from_cells([(x, y)], level=3).fingerprint for x in range(8) for y in range(8)
+        }
+        assert len(fingerprints) == 64
+        assert 0 <= node.fingerprint < 2**64
+
+    def test_node_size(self):
+        node = Node.from_cells({(1, 0), (2, 1)}, level=3)
+        assert not hasattr(node, "__dict__")
+        # object header and one pointer per slot
+        assert Node.__basicsize__ == object.__basicsize__ + 8 * len(Node.__slots__)
+        assert node.fingerprint == Node.from_cells({(1, 0), (2, 1)}, level=3).fingerprint
+
+    def test_get_region(self):
+        cells = {(0, 0), (3, 1), (5, 5), (6, 7), (7, 7)}
+        node = Node.from_cells(cells, level=3)
+        region = node.get_region(2, 1, 7, 8)
+        assert len(region) == 5 * 7
+        assert {(i % 5 + 2, i // 5 + 1) for i, alive in enumerate(region) if alive} == {
+            (3, 1), (5, 5), (6, 7)
+        }
+        assert node.get_region(-2, -2, 0, 1) == bytes(2 * 3)
+        assert node.get_region(-1, -1, 1, 1) == bytes((0, 0, 0, 1))
+        assert node.get_region(0, 0, 0, 4) == b""
+        big = Node.from_cells({(2**40 + 1, 2**41)})
+        assert big.get_region(2**40, 2**41, 2**40 + 2, 2**41 + 1) == bytes((0, 1))
+
+    def test_render(self):
+        cells = {(0, 0), (1, 1), (3, 1), (5, 5), (6, 7), (7, 7)}
+        node = Node.from_cells(cells, level=3)
+        assert node.render((0, 0, 8, 8), scale=2) == [[3, 0], [0, 3]]
+        assert node.render((0, 0, 8, 8), scale=3) == [[6]]
+        assert node.render((0, 0, 4, 2)) == [[1, 0, 0, 0], [0, 1, 0, 1]]
+        # unaligned viewport, pixels cover (1..2, 1..2), (3..4, 1..2), ...
+        assert node.render((1, 1, 7, 3), scale=1) == [[1, 1, 0]]
+        assert node.render((-8, -8, 0, 0), scale=2) == [[0, 0], [0, 0]]
+        # one pixel covering a whole huge subtree
+        big = Node.from_cells(cells, level=40)
+        assert big.render((0, 0, 2**40, 2**40), scale=40) == [[6]]
+
+    def test_from_state_map_round_trip(self):
+        strmap = "0110" "1001" "0000" "1111" "0101" "1010" "0011" "1100" * 8
+        node = Node.from_state_map(str_to_state_map(strmap))
+        assert node.level == 4
+        assert state_map_to_str(node.as_state_map()) == strmap
+
+    @pytest.mark.parametrize("power", range(3))
+    def test_step_gen(self, power):
+        node = Node.from_state_map(str_to_state_map("0100" "0010" "1110" "0000"))
+        node = node.expand().expand().expand()
+        expected = live_cells(node)
+        for _ in range(2**power):
+            expected = life_step(expected)
+        assert live_cells(node.step_gen(power)) == expected
+        assert node.step_gen(power) is node.step_gen(power)
+        with pytest.raises(ValueError):
+            node.step_gen(node.level - 1)
+
+    @pytest.mark.parametrize("power", [0, 1, 3, 4])
+    def test_step_gen_with_hooks(self, power):
+        # with STATS set, evaluation takes the general path instead of the plain one
+        cells = random_cells(32, power)
+        expected = Node.from_cells(cells, level=6).step_gen(power).flatten()
+        Node.ALL_NODES = {}
+        Node.ALL_EMPTY = {}
+        Node.STATS = Stats()
+        assert Node.from_cells(cells, level=6).step_gen(power).flatten() == expected
+        assert sum(Node.STATS.memo_misses.values()) > 0
+
+    @pytest.mark.parametrize("generations", [0, 1, 2, 5, 13, 30])
+    def test_advance(self, generations):
+        # r-pentomino, grows past its initial 4x4 universe
+        node = Node.from_state_map(str_to_state_map("0110" "1100" "0100" "0000"))
+        expected = live_cells(node)
+        for _ in range(generations):
+            expected = life_step(expected)
+        assert live_cells(advance(node, generations)) == expected
+
+    def test_advance_far(self):
+        node = Node.from_state_map(str_to_state_map("0100" "0010" "1110" "0000"))
+        n_far = advance(node, 10**9)
+        # glider travels one cell diagonally every 4 generations
+        offset = 10**9 // 4
+        assert live_cells(n_far) == {(x + offset, y + offset) for x, y in live_cells(node)}
+        with pytest.raises(ValueError):
+            advance(node, -1)
+
+    def test_advance_collects(self):
+        strmap = "0110" "1100" "0100" "0000"
+        expected = live_cells(advance(Node.from_state_map(str_to_state_map(strmap)), 1023))
+        assert len(Node.ALL_NODES) > 10000
+        Node.ALL_NODES = {}
+        Node.ALL_EMPTY = {}
+        Node.MAX_NODES = 3000
+        n_far = advance(Node.from_state_map(str_to_state_map(strmap)), 1023)
+        assert live_cells(n_far) == expected
+        assert Node.last_collect.collected > 0
+        assert len(Node.ALL_NODES) <= Node.MAX_NODES
+
+    def test_advance_keeps_roots(self):
+        Node.MAX_NODES = 30
+        glider = Node.from_cells({(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)})
+        other = Node.from_cells({(0, 0), (1, 0), (2, 0)}, level=3)
+        advance(glider, 64, roots=(other,))
+        assert Node.last_collect.collected > 0
+        for node in (glider, other):
+            assert Node(node.nw, node.ne, node.sw, node.se) is node
+
+
+def test_parse_rule():
+    assert parse_rule("B3/S23") == (frozenset((3,)), frozenset((2, 3)))
+    assert parse_rule("b36/s") == (frozenset((3, 6)), frozenset())
+    assert format_rule(*parse_rule("B63/S32")) == "B36/S23"
+    for rule in ("", "B3", "S23/B3", "B3/S29", "B3/S2/3"):
+        with pytest.raises(ValueError):
+            parse_rule(rule)
+
+
+def test_universes_side_by_side():
+    life = Universe("B3/S23")
+    highlife = Universe("B36/S23", share=life)
+    assert repr(highlife) == "Universe('B36/S23')"
+    # six neighbors around (2, 2), born only under B36
+    cells = {(1, 1), (2, 1), (3, 1), (1, 3), (2, 3), (3, 3)}
+    n_life = life.from_cells(cells, level=3)
+    # the same cells are the same node, only the results depend on the rule
+    assert highlife.from_cells(cells, level=3) is n_life
+    assert highlife.adopt(n_life) is n_life
+    assert highlife.node_cls.ALL_NODES is life.node_cls.ALL_NODES
+    assert (2, 2) not in {(x + 2, y + 2) for x, y in n_life.next_gen().iter_live_cells()}
+    n_high = highlife.next_gen(n_life)
+    assert (2, 2) in {(x + 2, y + 2) for x, y in n_high.iter_live_cells()}
+    assert life.next_gen(n_life) is n_life.next_gen() is not n_high
+    assert highlife.step_gen(n_life, 0) is n_high
+    assert [progress.result for progress in highlife.iter_step_gen(n_life, 0)][-1] is n_high
+    assert set(highlife.advance(n_life, 1).iter_live_cells()) == set(
+        Universe("B36/S23").advance(n_life, 1).iter_live_cells()
+    )
+    # collecting the shared store keeps every universe's memos of the nodes kept
+    stats = highlife.collect([n_life])
+    assert stats.kept == len(life.node_cls.ALL_NODES)
+    assert highlife.node_cls._get_memo(n_life, 0) is n_high
+    assert n_life._next_gen is not None
+    highlife.collect([])
+    # only empty nodes are kept
+    assert set(highlife.node_cls._MEMOS[0]) <= set(life.node_cls.ALL_EMPTY.values())
+    with pytest.raises(ValueError):
+        Universe("B2/S/C3", share=life)
+
+
+def test_shared_memos_dropped_with_results():
+    life = Universe("B3/S23")
+    highlife = Universe("B36/S23", share=life)
+    node = highlife.from_cells(random_cells(16, 0), level=5)
+    highlife.next_gen(node)
+    # without following memos, results only reachable from the shared tables are swept
+    highlife.collect([node], max_memo_age=-1)
+    all_nodes = life.node_cls.ALL_NODES
+    for memos in highlife.node_cls._MEMOS.values():
+        for result in memos.values():
+            assert all_nodes.get((result.nw, result.ne, result.sw, result.se)) is result
+    n_high = highlife.next_gen(node)
+    assert n_high is highlife.node_cls(n_high.nw, n_high.ne, n_high.sw, n_high.se)
+
+
+def test_universe_private_store():
+    life = Universe("B3/S23")
+    highlife = Universe("B36/S23")
+    cells = {(1, 1), (2, 1), (3, 1), (1, 3), (2, 3), (3, 3)}
+    n_life = life.from_cells(cells, level=3)
+    n_high = highlife.from_cells(cells, level=3)
+    assert n_life is not n_high
+    assert highlife.adopt(n_life) is n_high
+    assert highlife.next_gen(n_life) is n_high.next_gen()
+    assert set(highlife.advance(n_life, 1).iter_live_cells()) == set(
+        advance(n_high, 1).iter_live_cells()
+    )
+    assert Universe("B36/S23", share=Node).from_cells(cells) is Node.from_cells(cells)
+    highlife.collect([])
+    assert life.node_cls.ALL_NODES
+
+
+def test_cell():
+    assert Cell(2) is CELLS[2]
+    assert Cell(2) == 2
+    assert repr(Cell(2)) == "Cell(2)"
+    assert (Cell(0).population, Cell(1).population, Cell(2).population) == (0, 1, 1)
+    assert Cell(1).fingerprint == State.ALIVE.fingerprint
+    assert Cell(0).fingerprint == State.DEAD.fingerprint
+    with pytest.raises(ValueError):
+        Cell(256)
+
+
+def test_parse_generations_rule():
+    assert parse_generations_rule("B2/S/C3") == (frozenset((2,)), frozenset(), 3)
+    assert generations_transitions(frozenset((2,)), frozenset(), 3) == (
+        (0, 0, 1, 0, 0, 0, 0, 0, 0),
+        (2,) * 9,
+        (0,) * 9,
+    )
+    for rule in ("B2/S", "B2/S/3", "B2/S/C1", "B2/S/C257", "B2/S9/C3"):
+        with pytest.raises(ValueError):
+            parse_generations_rule(rule)
+    assert repr(Universe("b2/s/c3")) == "Universe('B2/S/C3')"
+    assert repr(Universe("wireworld")) == "Universe('WireWorld')"
+
+
+@pytest.mark.parametrize(
+    "rule,transitions", [
+        ("B2/S/C3", generations_transitions(frozenset((2,)), frozenset(), 3)),
+        ("B3/S23/C5", generations_transitions(frozenset((3,)), frozenset((2, 3)), 5)),
+        ("WireWorld", WIREWORLD_TRANSITIONS),
+    ]
+)
+@pytest.mark.parametrize("generations", [1, 6, 37])
+def test_multistate_advance(rule, transitions, generations):
+    universe = Universe(rule)
+    rand = random.Random(generations)
+    cells = {(x, y): rand.randrange(len(transitions)) for x in range(12) for y in range(12)}
+    node = universe.from_cells(cells, level=4)
+    expected = multistate_cells(node)
+    for _ in range(generations):
+        expected = multistate_step(expected, transitions)
+    result = universe.advance(node, generations)
+    assert multistate_cells(result) == expected
+    assert result.population == len(expected)
+
+
+def test_multistate_matches_life():
+    life = Universe("B3/S23")
+    generations = Universe("B3/S23/C2")
+    cells = random_cells(16, 0)
+    n_life = life.advance(life.from_cells(cells), 50)
+    n_generations = generations.advance(generations.from_cells(cells), 50)
+    assert set(n_life.iter_live_cells()) == set(n_generations.iter_live_cells())
+    assert n_life.fingerprint == n_generations.fingerprint
+    assert generations.adopt(n_life) is n_generations
+
+
+def test_multistate_adopt_and_region():
+    brain = Universe("B2/S/C3")
+    node = brain.from_cells({(0, 0): 1, (1, 0): 2, (3, 3): 1})
+    assert node.get_region(0, 0, 4, 1) == bytes((1, 2, 0, 0))
+    assert brain.node_cls.unflatten(node.flatten()) is node
+    with pytest.raises(ValueError):
+        Universe("B3/S23").adopt(node)
+    with pytest.raises(ValueError):
+        brain.from_cells({(0, 0): 3})
+    life = Universe("B3/S23")
+    n_life = life.from_cells([(0, 0), (3, 3)])
+    adopted = brain.adopt(n_life)
+    assert set(adopted.iter_cells()) == {(0, 0, 1), (3, 3, 1)}
+    assert life.adopt(adopted) is n_life
+
+
+@pytest.mark.parametrize("generations", [0, 1, 3, 4, 13, 50])
+def test_advance_torus(generations):
+    cells = random_cells(16, generations)
+    expected = cells
+    for _ in range(generations):
+        expected = life_step_torus(expected, 16)
+    node = Node.from_cells(cells, level=4)
+    result = advance(node, generations, Topology.TORUS)
+    assert result.level == 4
+    assert set(result.iter_live_cells()) == expected
+    assert advance(node, generations, "torus") is result
+
+
+def test_advance_torus_glider_far():
+    glider = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+    node = Node.from_cells(glider, level=3)
+    # once around an 8x8 torus every 32 generations
+    assert advance(node, 32, Topology.TORUS) is node
+    assert advance(node, 10**15 + 5, Topology.TORUS) is advance(node, 5, Topology.TORUS)
+
+
+@pytest.mark.parametrize("generations", [1, 7, 60])
+def test_advance_bounded(generations):
+    rand = random.Random(generations)
+    cells = {(x, y) for x in range(8) for y in range(8) if rand.random() < 0.5}
+    expected = cells
+    for _ in range(generations):
+        expected = {(x, y) for x, y in life_step(expected) if 0 <= x < 8 and 0 <= y < 8}
+    result = advance(Node.from_cells(cells, level=3), generations, Topology.BOUNDED)
+    assert result.level == 3
+    assert set(result.iter_live_cells()) == expected
+
+
+def test_advance_bounded_glider():
+    glider = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+    node = advance(Node.from_cells(glider, level=3), 10**12, Topology.BOUNDED)
+    # a glider running into a corner settles into a block
+    assert set(node.iter_live_cells()) == {(6, 6), (7, 6), (6, 7), (7, 7)}
+    with pytest.raises(ValueError):
+        advance(State.ALIVE, 1, Topology.BOUNDED)
@@ -0,0 +1,87 @@
+"""Tests for dense module"""
+
+import pytest
+
+from hashlife.core import Node, Stats, Universe, advance
+
+from tests.helpers import random_cells
+
+np = pytest.importorskip("numpy")
+dense = pytest.importorskip("hashlife.dense")
+
+
+def test_array_round_trip():
+    cells = random_cells(32, 0)
+    node = Node.from_cells(cells, level=5)
+    array = dense.to_array(node)
+    assert array.shape == (32, 32)
+    assert {(x, y) for y, x in zip(*np.nonzero(array))} == cells
+    assert dense.from_array(array) is node
+    assert dense.from_array(np.zeros((4, 4), dtype=np.uint8)) is Node.empty(2)
+    with pytest.raises(ValueError):
+        dense.from_array(np.zeros((6, 6)))
+    with pytest.raises(ValueError):
+        dense.from_array(np.zeros((4, 8)))
+
+
+@pytest.mark.parametrize("power", range(4))
+def test_dense_step(power):
+    node = Node.from_cells(random_cells(32, power), level=5)
+    assert dense.dense_step(node, power) is node.step_gen(power)
+
+
+@pytest.mark.parametrize("dense_level", [3, 4, 6])
+def test_hybrid_advance(dense_level):
+    cells = random_cells(32, 1)
+    expected = set(advance(Node.from_cells(cells), 100).iter_live_cells())
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    Node.DENSE_LEVEL = dense_level
+    assert set(advance(Node.from_cells(cells), 100).iter_live_cells()) == expected
+
+
+def test_hybrid_hit_rate(monkeypatch):
+    levels = []
+    step = dense.dense_step
+
+    def dense_step(node, power, node_cls=None):
+        levels.append(node.level)
+        return step(node, power, node_cls)
+
+    monkeypatch.setattr(dense, "dense_step", dense_step)
+    cells = random_cells(32, 3)
+    expected = set(advance(Node.from_cells(cells), 64).iter_live_cells())
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    Node.DENSE_LEVEL = 6
+    Node.DENSE_HIT_RATE = 0.7
+    with pytest.raises(ValueError):
+        Node.from_cells(cells).next_gen()
+    Node.STATS = Stats()
+    # nothing is measured before the first step
+    Node.from_cells(cells).expand().next_gen()
+    assert not levels
+    assert set(advance(Node.from_cells(cells), 64).iter_live_cells()) == expected
+    assert levels and set(levels) <= {3, 4, 5, 6}
+    Node.DENSE_HIT_RATE = 0
+    del levels[:]
+    advance(Node.from_cells(random_cells(32, 4)), 64)
+    assert not levels
+
+
+def test_hybrid_universe():
+    highlife = Universe("B36/S23")
+    highlife.node_cls.DENSE_LEVEL = 5
+    node = highlife.from_cells(random_cells(32, 2), level=6)
+    expected = Universe("B36/S23").adopt(node).leap_gen()
+    assert node.leap_gen().flatten() == expected.flatten()
+
+
+def test_multi_state_unsupported():
+    brain = Universe("B2/S/C3")
+    brain.node_cls.DENSE_LEVEL = 4
+    node = brain.from_cells({(0, 0): 1, (1, 0): 1}, level=5)
+    with pytest.raises(ValueError):
+        node.leap_gen()
+    with pytest.raises(ValueError):
+        node.iter_step_gen(2, chunk_size=10)
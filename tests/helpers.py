@@ -0,0 +1,9 @@
+"""Helpers shared by the tests"""
+
+import random
+
+
+def random_cells(size, seed, density=0.4):
+    """Return a random soup of live cells in a size x size square"""
+    rng = random.Random(seed)
+    return {(x, y) for x in range(size) for y in range(size) if rng.random() < density}
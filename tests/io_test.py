@@ -1,9 +1,19 @@
 """Tests for io module"""
 
+import io
+import random
+
 import pytest
 
-from hashlife.core import State, StateMap
-from hashlife.io import str_to_state_map, state_map_to_str
+from hashlife.core import Node, State, StateMap, Stats, Universe
+from hashlife.io import (
+    str_to_state_map, state_map_to_str, str_to_node, node_to_str, read_rle, write_rle,
+    read_macrocell, write_macrocell, save_snapshot, load_snapshot
+)
+
+RULE_BIRTH = Node.RULE_BIRTH
+GLIDER = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+
 
 def test_str_to_state_map():
     with pytest.raises(ValueError):
@@ -17,14 +27,270 @@ def test_str_to_state_map():
     with pytest.raises(ValueError):
         str_to_state_map("0110", "1", "01")
     with pytest.raises(ValueError):
-        str_to_state_map("123")
+        str_to_state_map("23")
     with pytest.raises(ValueError):
-        str_to_state_map("123456789")
+        str_to_state_map("01101")
     m = str_to_state_map("0110", '1', '0')
     assert m.rows == [[State.DEAD, State.ALIVE], [State.ALIVE, State.DEAD]]
     assert m.level == 1
+    # sides that are not a power of two are padded with dead cells
+    m = str_to_state_map("123")
+    assert m.rows == [[State.ALIVE, State.DEAD], [State.DEAD, State.DEAD]]
+    m = str_to_state_map("010\n111\n010")
+    assert m.level == 2
+    assert state_map_to_str(m) == "0100" "1110" "0100" "0000"
+    m = str_to_state_map(b"#.\n.#", "#", ".")
+    assert m.rows == [[State.ALIVE, State.DEAD], [State.DEAD, State.ALIVE]]
 
 
 def test_state_map_to_str():
     state_map = StateMap(1, [[State.DEAD, State.ALIVE], [State.ALIVE, State.DEAD]])
     assert state_map_to_str(state_map) == "0110"
+    assert state_map_to_str(state_map, "##", "  ") == "  ####  "
+    assert state_map_to_str(state_map, "\u2588", " ") == " \u2588\u2588 "
+
+
+@pytest.mark.parametrize("side", [2, 3, 4, 7, 16, 45])
+def test_str_to_node(side):
+    rand = random.Random(side)
+    rows = ["".join(rand.choice(".O") for _ in range(side)) for _ in range(side)]
+    strmap = "\n".join(rows)
+    node = str_to_node(strmap, "O", ".")
+    assert node is Node.from_state_map(str_to_state_map(strmap, "O", "."))
+    assert str_to_node(memoryview(strmap.encode()), "O", ".") is node
+    size = 2**node.level
+    text = node_to_str(node, "O", ".")
+    assert [text[start:start + side] for start in range(0, size * side, size)] == rows
+    assert text == state_map_to_str(node.as_state_map(), "O", ".")
+
+
+def test_str_to_node_universe():
+    highlife = Universe("B36/S23")
+    node = str_to_node("0110", node_cls=highlife.node_cls)
+    assert isinstance(node, highlife.node_cls)
+    assert set(node.iter_live_cells()) == {(1, 0), (0, 1)}
+
+
+def test_read_rle():
+    rle = io.StringIO(
+        "#N Glider\n"
+        "x = 3, y = 3, rule = B3/S23\n"
+        "bob$2bo$3o!\n"
+    )
+    assert set(read_rle(rle).iter_live_cells()) == GLIDER
+    with pytest.raises(ValueError):
+        read_rle(io.StringIO("x = 1, y = 1\nbo$"))
+    with pytest.raises(ValueError):
+        read_rle(io.StringIO("x = 1, y = 1\nbq!"))
+
+
+def test_write_rle():
+    out = io.StringIO()
+    write_rle(Node.from_cells({(x + 5, y + 9) for x, y in GLIDER}), out)
+    assert out.getvalue() == "x = 3, y = 3, rule = B3/S23\nbo$2bo$3o!\n"
+    out = io.StringIO()
+    write_rle(Node.empty(3), out)
+    assert out.getvalue() == "x = 0, y = 0, rule = B3/S23\n!\n"
+
+
+def test_rle_round_trip():
+    rng = random.Random(0)
+    cells = {(rng.randrange(300), rng.randrange(50)) for _ in range(2000)}
+    cells.add((0, 0))
+    out = io.StringIO()
+    write_rle(Node.from_cells(cells), out, line_length=20)
+    assert max(len(line) for line in out.getvalue().splitlines()[1:]) <= 20
+    out.seek(0)
+    assert set(read_rle(out).iter_live_cells()) == cells
+
+
+def test_rle_multi_state():
+    wireworld = Universe("WireWorld")
+    cells = {(0, 0): 1, (1, 0): 2, (2, 0): 3, (3, 0): 3, (1, 2): 3}
+    out = io.StringIO()
+    write_rle(wireworld.from_cells(cells), out)
+    assert out.getvalue() == "x = 4, y = 3, rule = WireWorld\nAB2C2$.C!\n"
+    out.seek(0)
+    node = read_rle(out, wireworld.node_cls)
+    assert {(x, y): state for x, y, state in node.iter_cells()} == cells
+    out.seek(0)
+    with pytest.raises(ValueError):
+        read_rle(out)
+    generations = Universe("B2/S/C30")
+    cells = {(state, 0): state for state in range(1, 30)}
+    out = io.StringIO()
+    write_rle(generations.from_cells(cells), out)
+    assert out.getvalue().splitlines()[1] == "ABCDEFGHIJKLMNOPQRSTUVWXpApBpCpDpE!"
+    out.seek(0)
+    node = read_rle(out, generations.node_cls)
+    assert {(x + 1, y): state for x, y, state in node.iter_cells()} == cells
+    with pytest.raises(ValueError):
+        read_rle(io.StringIO("x = 1, y = 1\npb!"), generations.node_cls)
+
+
+def test_rle_rule():
+    life = Universe("B3/S23")
+    highlife = Universe("B36/S23", share=life)
+    node = highlife.from_cells(GLIDER)
+    out = io.StringIO()
+    write_rle(node, out, node_cls=highlife.node_cls)
+    assert out.getvalue().startswith("x = 3, y = 3, rule = B36/S23\n")
+    out.seek(0)
+    assert read_rle(out, highlife.node_cls) is node
+    out.seek(0)
+    with pytest.raises(ValueError):
+        read_rle(out, life.node_cls)
+    with pytest.raises(ValueError):
+        read_rle(io.StringIO("x = 1, y = 1, rule = LifeHistory\no!"))
+    node = read_rle(io.StringIO("x = 1, y = 1, rule = b3/s23:T8,8\no!"))
+    assert set(node.iter_live_cells()) == {(0, 0)}
+
+
+def test_read_macrocell():
+    mc = io.StringIO(
+        "[M2] (golly 2.0)\n"
+        "#R B3/S23\n"
+        ".*$..*$***$\n"
+        "4 1 0 0 1\n"
+    )
+    node = read_macrocell(mc)
+    assert node.level == 4
+    assert set(node.iter_live_cells()) == GLIDER | {(x + 8, y + 8) for x, y in GLIDER}
+    assert node.nw is node.se
+    with pytest.raises(ValueError):
+        read_macrocell(io.StringIO("4 1 0 0 1\n"))
+    with pytest.raises(ValueError):
+        read_macrocell(io.StringIO("[M2]\n4 1 0 0 1\n"))
+
+
+@pytest.mark.parametrize("level", [1, 3, 12])
+def test_macrocell_round_trip(level):
+    rng = random.Random(level)
+    size = 2**level
+    cells = {(rng.randrange(size), rng.randrange(size)) for _ in range(size)}
+    node = Node.from_cells(cells, level=level)
+    out = io.StringIO()
+    write_macrocell(node, out)
+    out.seek(0)
+    read = read_macrocell(out)
+    while read.level > level:
+        read = read.shrink()
+    assert read is node
+
+
+def test_macrocell_empty():
+    out = io.StringIO()
+    write_macrocell(Node.empty(5), out)
+    out.seek(0)
+    assert read_macrocell(out) is Node.empty(5)
+
+
+def test_macrocell_rule():
+    life = Universe("B3/S23")
+    highlife = Universe("B36/S23", share=life)
+    node = highlife.from_cells(GLIDER, level=3)
+    out = io.StringIO()
+    write_macrocell(node, out, node_cls=highlife.node_cls)
+    assert out.getvalue().splitlines()[1] == "#R B36/S23"
+    out.seek(0)
+    assert read_macrocell(out, highlife.node_cls) is node
+    out.seek(0)
+    with pytest.raises(ValueError):
+        read_macrocell(out, life.node_cls)
+
+
+def test_macrocell_multi_state():
+    node = Universe("WireWorld").from_cells({(0, 0): 1, (1, 0): 2})
+    with pytest.raises(ValueError):
+        write_macrocell(node, io.StringIO())
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "nodes.snap")
+    node = Node.from_cells(GLIDER).expand().expand()
+    table, leap_table = node.flatten(), node.leap_gen().flatten()
+    other = Node.from_cells({(0, 0), (1, 1)}, level=5)
+    save_snapshot(path, [node, other])
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    loaded, loaded_other = load_snapshot(path)
+    assert loaded.flatten() == table
+    assert loaded._leap_gen is None
+    Node.STATS = Stats()
+    assert loaded.leap_gen().flatten() == leap_table
+    assert not Node.STATS.memo_misses
+    assert loaded._leap_gen is not None
+    assert set(loaded_other.iter_live_cells()) == {(0, 0), (1, 1)}
+    assert loaded is Node.unflatten(table)
+
+
+def test_snapshot_only_reachable(tmp_path):
+    path = str(tmp_path / "nodes.snap")
+    node = Node.from_cells(GLIDER)
+    Node.from_cells({(5, 5), (6, 6), (7, 5)})
+    save_snapshot(path, [node])
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    assert load_snapshot(path) == [Node.unflatten(node.flatten())]
+    assert len(Node.ALL_NODES) == len(node.flatten())
+
+
+def test_snapshot_lazy_memos(tmp_path):
+    path = str(tmp_path / "nodes.snap")
+    rng = random.Random(1)
+    node = Node.from_cells({(x, y) for x in range(16) for y in range(16) if rng.random() < 0.4})
+    node = node.expand()
+    between = Node.centered_horizontal(node.nw, node.ne)
+    tables = [
+        node.leap_gen().flatten(),
+        between.leap_gen().flatten(),
+        between.next_gen().flatten(),
+    ]
+    save_snapshot(path, [node])
+    saved = len(Node.ALL_NODES)
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    loaded, = load_snapshot(path)
+    assert len(Node.ALL_NODES) == len(node.flatten()) < saved
+    Node.STATS = Stats()
+    between = Node.centered_horizontal(loaded.nw, loaded.ne)
+    # intermediate results are loaded when first needed, not recomputed
+    assert [
+        loaded.leap_gen().flatten(),
+        between.leap_gen().flatten(),
+        between.next_gen().flatten(),
+    ] == tables
+    assert not Node.STATS.memo_misses
+    assert sum(Node.STATS.memo_hits.values()) == 3
+    Node.collect([loaded])
+    assert Node.centered_horizontal(loaded.nw, loaded.ne).next_gen().flatten() == tables[2]
+    assert not Node.STATS.memo_misses
+
+
+def test_snapshot_rules_differ(tmp_path):
+    path = str(tmp_path / "nodes.snap")
+    save_snapshot(path, [Node.from_cells(GLIDER)])
+    Node.RULE_BIRTH = frozenset((3, 6))
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+    with open(path, "r+b") as fileobj:
+        fileobj.write(b"NOTSNAPS")
+    Node.RULE_BIRTH = RULE_BIRTH
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+
+
+def test_snapshot_universe(tmp_path):
+    path = str(tmp_path / "nodes.snap")
+    highlife = Universe("B36/S23")
+    node = highlife.from_cells(GLIDER)
+    save_snapshot(path, [node], highlife.node_cls)
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+    assert load_snapshot(path, Universe("B36/S23").node_cls)[0].flatten() == node.flatten()
+
+
+def test_snapshot_multistate(tmp_path):
+    brain = Universe("B2/S/C3")
+    with pytest.raises(ValueError):
+        save_snapshot(str(tmp_path / "nodes.snap"), [brain.from_cells({(0, 0): 2})], brain.node_cls)
@@ -0,0 +1,38 @@
+"""Tests for parallel module"""
+
+import pytest
+
+from hashlife.core import Node, Universe
+from hashlife.parallel import parallel_leap_gen
+
+from tests.helpers import random_cells
+
+
+def test_flatten_round_trip():
+    node = Node.from_cells(random_cells(32, 0))
+    table = node.flatten()
+    assert len(table) == len(set(table))
+    assert Node.unflatten(table) is node
+
+
+@pytest.mark.parametrize("depth", [0, 1, 2])
+def test_parallel_leap_gen(depth):
+    cells = random_cells(32, depth)
+    expected = Node.from_cells(cells).leap_gen().flatten()
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    node = Node.from_cells(cells)
+    n_leap = parallel_leap_gen(node, depth=depth, processes=2)
+    assert n_leap.flatten() == expected
+    assert node.leap_gen() is n_leap
+
+
+def test_parallel_leap_gen_universe():
+    cells = random_cells(32, 3)
+    expected = Node.from_cells(cells).leap_gen().flatten()
+    expected_high = Universe("B36/S23").from_cells(cells).leap_gen()
+    highlife = Universe("B36/S23")
+    n_leap = parallel_leap_gen(highlife.from_cells(cells), processes=2)
+    assert isinstance(n_leap, highlife.node_cls)
+    assert n_leap.flatten() == expected_high.flatten()
+    assert n_leap.flatten() != expected
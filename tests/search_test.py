@@ -0,0 +1,136 @@
+"""Tests for search module"""
+
+import io
+
+import pytest
+
+from hashlife.core import Node, Universe, advance
+from hashlife.io import read_rle
+from hashlife.search import Period, detect_period, run_batch
+
+from tests.helpers import random_cells
+
+BLOCK = {(0, 0), (1, 0), (0, 1), (1, 1)}
+BLINKER = {(0, 1), (1, 1), (2, 1)}
+GLIDER = {(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)}
+LWSS = {(1, 0), (4, 0), (0, 1), (0, 2), (4, 2), (0, 3), (1, 3), (2, 3), (3, 3)}
+R_PENTOMINO = {(1, 0), (2, 0), (0, 1), (1, 1), (1, 2)}
+PULSAR = """\
+x = 13, y = 13, rule = B3/S23
+2b3o3b3o2b2$o4bobo4bo$o4bobo4bo$o4bobo4bo$2b3o3b3o2b2$2b3o3b3o2b$o4bobo4bo$o4bobo4bo$
+o4bobo4bo2$2b3o3b3o!
+"""
+
+
+@pytest.mark.parametrize(
+    "cells,period,displacement", [
+        (BLOCK, 1, (0, 0)),
+        (BLINKER, 2, (0, 0)),
+        (GLIDER, 4, (1, 1)),
+        (LWSS, 4, (-2, 0)),
+    ]
+)
+def test_detect_period(cells, period, displacement):
+    result = detect_period(Node.from_cells(cells), 100)
+    assert (result.period, result.displacement) == (period, displacement)
+    assert 0 <= result.generation <= 2 * period
+
+
+def test_detect_period_bounded_store():
+    Node.MAX_NODES = 50
+    result = detect_period(Node.from_cells(GLIDER), 100)
+    assert Node.last_collect is not None
+    assert (result.period, result.displacement) == (4, (1, 1))
+
+
+def test_detect_period_settles():
+    # a pre-block settles into a block after one generation
+    result = detect_period(Node.from_cells({(0, 0), (1, 0), (0, 1)}), 10)
+    assert result.period == 1
+    assert result.displacement == (0, 0)
+    assert result.generation >= 1
+
+
+def test_detect_period_dies():
+    assert detect_period(Node.from_cells({(0, 0)}), 10).period == 1
+    assert detect_period(Node.empty(3), 10) == Period(1, (0, 0), 0)
+
+
+def test_detect_period_narrowed():
+    # a row of ten cells becomes a pentadecathlon within two generations
+    assert detect_period(Node.from_cells({(x, 0) for x in range(10)}), 16) is None
+    result = detect_period(Node.from_cells({(x, 0) for x in range(10)}), 17)
+    assert (result.period, result.displacement) == (15, (0, 0))
+    node = advance(Node.from_cells({(x, 0) for x in range(10)}), result.generation)
+    assert advance(node, 15).flatten() == node.flatten()
+
+
+def test_detect_period_pulsar():
+    pulsar = read_rle(io.StringIO(PULSAR))
+    assert detect_period(pulsar, 2) is None
+    assert detect_period(pulsar, 10) == Period(3, (0, 0), 0)
+
+
+def test_detect_period_not_found():
+    assert detect_period(Node.from_cells(R_PENTOMINO), 100) is None
+    # stabilizes after 1103 generations, leaving gliders and oscillators of period 2
+    node = advance(Node.from_cells(R_PENTOMINO), 1200)
+    assert detect_period(node, 10) is None
+
+
+def test_detect_period_multistate():
+    brain = Universe("B2/S/C3")
+    ship = brain.from_cells({(0, 0): 1, (1, 0): 1, (0, 1): 2, (1, 1): 2})
+    assert detect_period(ship, 10)[:2] == (1, (0, -1))
+    wireworld = Universe("WireWorld")
+    # an electron on a 6x3 conductor loop, cutting the corners diagonally
+    loop = {(x, y): 3 for x in range(6) for y in range(3) if x in (0, 5) or y in (0, 2)}
+    loop[(1, 0)], loop[(2, 0)] = 2, 1
+    # periodic from generation 1, so the repeat is seen at generation 11
+    assert detect_period(wireworld.from_cells(loop), 11)[:2] == (10, (0, 0))
+    assert detect_period(wireworld.from_cells(loop), 10) is None
+
+
+def soups(count, start=0):
+    return [random_cells(12, seed) for seed in range(start, start + count)]
+
+
+def test_run_batch():
+    expected = []
+    for cells in soups(12):
+        Node.ALL_NODES = {}
+        Node.ALL_EMPTY = {}
+        expected.append(advance(Node.from_cells(cells), 64).flatten())
+    Node.ALL_NODES = {}
+    Node.ALL_EMPTY = {}
+    results = run_batch(soups(12), 64, batch_size=4)
+    assert [result.flatten() for result in results] == expected
+
+
+def test_run_batch_bounded():
+    node_cls = Universe().node_cls
+    results = run_batch(soups(20, start=100), 64, batch_size=5, max_nodes=2000, node_cls=node_cls)
+    for index, _ in enumerate(results, 1):
+        if index % 5 == 1 and index > 1:
+            assert node_cls.last_collect.kept <= 2000
+
+
+def test_run_batch_keeps_small_memos():
+    node_cls = Universe().node_cls
+    results = run_batch([BLOCK, BLINKER] * 4, 64, batch_size=2, node_cls=node_cls)
+    sizes = [len(node_cls.ALL_NODES) for _ in results]
+    assert node_cls.last_collect.collected > 0
+    # the block and blinker are memoized once and kept between batches
+    assert node_cls.last_collect.kept > len(node_cls.ALL_EMPTY)
+    empty = set(node_cls.ALL_EMPTY.values())
+    assert all(node.level <= 4 for node in node_cls.ALL_NODES.values() if node not in empty)
+    assert max(sizes) < 200
+
+
+def test_run_batch_private_store():
+    glider = Node.from_cells(GLIDER)
+    nodes = dict(Node.ALL_NODES)
+    results = list(run_batch(soups(4), 64, batch_size=1, max_nodes=0))
+    assert all(type(result) is not Node for result in results)
+    assert Node.ALL_NODES == nodes
+    assert Node(glider.nw, glider.ne, glider.sw, glider.se) is glider